@@ -14,6 +14,7 @@
 # 	1. GNURadio 
 # 	2. pickle
 # 	3. pandas
+# 	4. numpy
 #
 # LICENSE:
 # Apache 2.0:
@@ -45,9 +46,10 @@ from gnuradio import uhd
 from gnuradio import analog
 from gnuradio.eng_option import eng_option
 from gnuradio.filter import firdes
-from optparse import OptionParser
+from optparse import OptionParser, Values
 from gnuradio import analog
 from gnuradio import filter
+from gnuradio.blocks import parse_file_metadata
 
 from sys import stderr, exit
 
@@ -57,9 +59,94 @@ import pickle
 import os
 import shutil
 import pmt
-
+import multiprocessing
+import socket
+import struct
+import json
+import copy
+import threading
+import zlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+	import zmq
+except ImportError:
+	zmq = None
+
+import numpy as np
 import pandas as pd
 
+def load_cal_table(filename, options, compact=False):
+	"""Loads a combined calibration as a table of conjugate unit phasors.
+
+	Inputs:
+		1. filename (string): combined calibration file (fc32), as written by calibrate()
+		2. options (object): sweep_time and num_bands of the current sweep plan
+		3. compact (bool): return 16 bit phase codes instead of phasors
+	Returns:
+		complex64 array of num_bands*sweep_time phasors, or uint16 phase codes for
+		phase_lut() where code 0 marks samples the calibration gates off.
+
+	Exits if the calibration does not hold exactly one sweep of the current plan.
+	"""
+	cal = np.fromfile(filename, dtype=np.complex64)
+	if len(cal) != options.sweep_time*options.num_bands:
+		stderr.write("Error: calibration %s has %d samples, the sweep plan needs %d\n" % (filename, len(cal), options.sweep_time*options.num_bands))
+		exit(1)
+	mag = np.abs(cal)
+	if compact:
+		codes = np.rint(-np.angle(cal)/np.pi*32767).astype(np.int32)+32768
+		return np.where(mag > 0, codes, 0).astype(np.uint16)
+	return np.where(mag > 0, np.conj(cal)/np.maximum(mag, 1e-30), 0).astype(np.complex64)
+
+_phase_lut = None
+
+def phase_lut():
+	"""Phasor for every 16 bit phase code of load_cal_table(compact=True).
+
+	The table (65536 phasors, 512 KB) is built once and shared by every caller; treat it as read-only.
+	"""
+	global _phase_lut
+	if _phase_lut is None:
+		_phase_lut = np.exp(1j*np.pi*(np.arange(65536)-32768)/32767.0).astype(np.complex64)
+		_phase_lut[0] = 0
+	return _phase_lut
+
+class cal_source(gr.sync_block):
+	"""Emits the compensation phasors of a calibration cyclically from memory.
+
+	Replaces a looping file_source of the combined calibration: the file is read once,
+	checked against the sweep plan and turned into conjugate unit phasors (multiply the
+	sweeper stream with it, no conjugation needed). With options.cal_compact the table is
+	kept as 16 bit phase codes (2 instead of 8 bytes per sample) and expanded through the
+	shared 512 KB phase_lut(). That only saves memory once the calibrations held at the same
+	time add up to more than about 87k samples. The output position is derived from
+	the number of items produced, so sample n of the stream always gets phasor n modulo the
+	sweep length.
+	"""
+
+	def __init__(self,options,filename):
+		gr.sync_block.__init__(self, name="cal_source", in_sig=None, out_sig=[np.complex64])
+		self.compact = getattr(options, 'cal_compact', False)
+		self.table = load_cal_table(filename, options, self.compact)
+		if self.compact:
+			self.lut = phase_lut()
+
+	def work(self, input_items, output_items):
+		out = output_items[0]
+		pos = self.nitems_written(0) % len(self.table)
+		i = 0
+		while i < len(out):
+			n = min(len(out)-i, len(self.table)-pos)
+			if self.compact:
+				np.take(self.lut, self.table[pos:pos+n], out=out[i:i+n])
+			else:
+				out[i:i+n] = self.table[pos:pos+n]
+			i = i+n
+			pos = 0
+		return len(out)
+
 class sweep_block(gr.top_block):
 
 	def __init__(self,options):
@@ -74,7 +161,7 @@ class sweep_block(gr.top_block):
 			# addr0 is of sweeper
 			# Note that mode 2, 1 and 10 require two time-synced USRPs
 			self.usrp_source = uhd.usrp_source(
-			",".join(("addr0=192.168.10.2,addr1=192.168.20.3", "")),
+			",".join(("addr0=192.168.10.2,addr1=192.168.20.3", recv_tuning_args(options))),
 			uhd.stream_args(
 			cpu_format="fc32",
 			channels=range(2),
@@ -91,7 +178,7 @@ class sweep_block(gr.top_block):
 		elif options.mode == 3 or options.mode == 0 or options.mode == 30:
 			# dev_args is of sweeper
 			self.usrp_source = uhd.usrp_source(
-			",".join((options.dev_args, "")),
+			",".join((options.dev_args, recv_tuning_args(options))),
 			uhd.stream_args(
 			cpu_format="fc32",
 			channels=range(1),
@@ -218,22 +305,22 @@ class sweep_block(gr.top_block):
 			
 				if options.mode == 1:
 					# Mode for compensated
-					self.blocks_file_src_cal = blocks.file_source(gr.sizeof_gr_complex*1, options.filename[2], True)
+					self.blocks_file_src_cal = cal_source(options, options.filename[2])
 
 				if options.mode == 10:
 					# Mode for uncompensated
 					self.blocks_file_src_cal = analog.sig_source_c(0, analog.GR_CONST_WAVE, 0, 0, 1)
 
 
-				# conjugate multiplier for compensation
-				self.blocks_mult_conj = blocks.multiply_conjugate_cc(1)
+				# multiplier for compensation (cal_source is already conjugated)
+				self.blocks_mult_cal = blocks.multiply_cc(1)
 
 				# Connections
 				self.connect((self.usrp_source,1),(self.blocks_head_0,0))
-				self.connect((self.usrp_source,0),(self.blocks_mult_conj,0)) # sweeper to multiply
-				self.connect((self.blocks_file_src_cal,0),(self.blocks_mult_conj,1)) # cal to multiply
+				self.connect((self.usrp_source,0),(self.blocks_mult_cal,0)) # sweeper to multiply
+				self.connect((self.blocks_file_src_cal,0),(self.blocks_mult_cal,1)) # cal to multiply
 
-				self.connect((self.blocks_mult_conj,0),(self.blocks_head_1,0)) # multiply to head
+				self.connect((self.blocks_mult_cal,0),(self.blocks_head_1,0)) # multiply to head
 				# self.connect((self.null_source_2,0),(self.blocks_head_2,0))
 				# self.connect((self.null_source_3,0),(self.blocks_head_3,0))
 
@@ -257,12 +344,16 @@ class sweep_block(gr.top_block):
 				self.blocks_skiphead_0 = blocks.skiphead(gr.sizeof_gr_complex*1, options.skip)
 
 				# file blocks
-				self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1,options.filename[0],False)
-				self.blocks_file_sink_0.set_unbuffered(False)
+				if getattr(options, 'archive', False):
+					# compressed, sweep-indexed archive instead of raw fc32
+					self.blocks_file_sink_0 = archive_sink(options, options.filename[0])
+				else:
+					self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1,options.filename[0],False)
+					self.blocks_file_sink_0.set_unbuffered(False)
 
 				if options.mode == 3:
 					# compensated signal
-					self.blocks_file_src_cal = blocks.file_source(gr.sizeof_gr_complex*1, options.filename[1], True)
+					self.blocks_file_src_cal = cal_source(options, options.filename[1])
 
 				if options.mode == 30:
 					# the following is for getting uncompensated stuff
@@ -270,8 +361,8 @@ class sweep_block(gr.top_block):
 				
 				
 							
-				# conjugate multiplier for compensation
-				self.blocks_mult_conj = blocks.multiply_conjugate_cc(1)
+				# multiplier for compensation (cal_source is already conjugated)
+				self.blocks_mult_cal = blocks.multiply_cc(1)
 
 				# DC Blocker
 				self.dc_blocker_xx_0 = filter.dc_blocker_cc(256, False)
@@ -282,14 +373,14 @@ class sweep_block(gr.top_block):
 
 				# Connections
 				self.connect((self.usrp_source,0),(self.dc_blocker_xx_0,0)) # sweeper to DC block
-				self.connect((self.dc_blocker_xx_0,0),(self.blocks_mult_conj,0)) # DC block to multiply conj
-				# self.connect((self.usrp_source,0),(self.blocks_mult_conj,0)) # sweeper to DC block
-				self.connect((self.blocks_file_src_cal,0),(self.blocks_mult_conj,1)) # cal to multiply
+				self.connect((self.dc_blocker_xx_0,0),(self.blocks_mult_cal,0)) # DC block to multiply
+				# self.connect((self.usrp_source,0),(self.blocks_mult_cal,0)) # sweeper to DC block
+				self.connect((self.blocks_file_src_cal,0),(self.blocks_mult_cal,1)) # cal to multiply
 
 				# no realtime calib - just receive:
 				#self.connect((self.dc_blocker_xx_0,0),(self.blocks_head_1,0))
 
-				self.connect((self.blocks_mult_conj,0),(self.blocks_skiphead_0,0)) # multiply to head
+				self.connect((self.blocks_mult_cal,0),(self.blocks_skiphead_0,0)) # multiply to head
 				#self.connect((self.blocks_skiphead_0,0),(self.blocks_head_1,0))
 
 				self.connect((self.blocks_skiphead_0,0),(self.blocks_keep_m_in_n_0 ,0))
@@ -297,6 +388,21 @@ class sweep_block(gr.top_block):
 
 				self.connect((self.blocks_head_1,0),(self.blocks_file_sink_0,0))
 
+				# Optional network stream of the same sweeps to remote consumers
+				if getattr(options, 'stream_addr', None):
+					self.sweep_stream_sink_0 = sweep_stream_sink(options)
+					self.connect((self.blocks_head_1,0),(self.sweep_stream_sink_0,0))
+
+				# Optional per-channel outputs (see channelize())
+				if getattr(options, 'channels', None):
+					self.channelizer_sink_0 = channelizer_sink(options)
+					self.connect((self.blocks_head_1,0),(self.channelizer_sink_0,0))
+
+				# Optional burst labels (see classify_bursts())
+				if getattr(options, 'burst_log', None):
+					self.burst_classifier_sink_0 = burst_classifier_sink(options)
+					self.connect((self.blocks_head_1,0),(self.burst_classifier_sink_0,0))
+
 			elif options.mode == 2:
 				# This mode sends pilots on normal USRP & receives through sweeper
 
@@ -372,6 +478,10 @@ class sweep_block(gr.top_block):
 				self.connect((self.blocks_head_3,0),(self.usrp_sink,1))
 				self.connect((self.blocks_head_2,0),(self.usrp_sink,0))
 
+		# Host streaming tuning (buffer sizes, thread placement)
+		if getattr(options, 'tune', False):
+			tune_flowgraph(self, options)
+
 class cal_block(gr.top_block):
 
     def __init__(self,options,filename):
@@ -381,7 +491,7 @@ class cal_block(gr.top_block):
         # Blocks
         ##################################################
         self.usrp_source = uhd.usrp_source(
-        	",".join((options.dev_args, "")),
+        	",".join((options.dev_args, recv_tuning_args(options))),
         	uhd.stream_args(
         		cpu_format="fc32",
         		channels=range(1),
@@ -501,6 +611,10 @@ class cal_block(gr.top_block):
             self.connect((self.analog_sig_source_x_0, 0), (self.blocks_head_0, 0))
             self.connect((self.blocks_head_0, 0), (self.uhd_usrp_sink_0, 0))
 
+        # Host streaming tuning (buffer sizes, thread placement)
+        if getattr(options, 'tune', False):
+            tune_flowgraph(self, options)
+
 class comb_block(gr.top_block):
 	def __init__(self,options,filename):
 		gr.top_block.__init__(self, "Top Block")
@@ -642,7 +756,8 @@ def calibrate(options,top_block_cls = cal_block):
 
 			mode 1: Self calibration using leakage between the TX and RX chains on the SweepSense 
 			daughterboard.
-			mode 2: Reserved. 
+			mode 2: Calibration tone from an external transmitter. Waits for Enter before every
+			tone. calibrate_timed() automates this with a second, MIMO-synced USRP.
 
 		7. num_bands: Total number of VCO bands enabled in both band1 and band2. (int)
 			Can be computed using the step_size_metrics() function.
@@ -672,22 +787,43 @@ def calibrate(options,top_block_cls = cal_block):
 
 		18. txsamp: Transmitter sampling frequency wherever applicable (float)
 	"""
+	capture_tones(options,top_block_cls)
+	filename1 = ['a','b'];
+	filename1[0] = options.filename[0][0:-4]+'_op.txt'
+	filename1[1] = options.filename[1]+'combined_rt_cal.dat'
+	combine_cal(options,filename1)
+
+def capture_tones(options,top_block_cls = cal_block):
+	"""Captures the sweeper's view of every calibration tone.
+
+	Inputs:
+		1. options (object)
+		2. top_block_cls (default is cal_block)
+	Outputs:
+		List of (tone frequency, capture file) pairs
+
+	Runs the calibration flowgraph once for every frequency in options.filename[0] and
+	saves one file per tone in the options.filename[1] folder. The list of saved files is
+	also written next to the frequency list as '<list>_op.txt'. Used by calibrate() and
+	characterize_vco(); see calibrate() for the attributes of options.
+	"""
 	cal_tone_list = open(options.filename[0],"r")
 	cal_tone_save = open(options.filename[0][0:-4]+'_op.txt',"w+")
-	filename1 = ['a','b'];
+	tones = []
 	f1 = cal_tone_list.readlines()
 	for entry in f1:
 		options.txfreq = int(entry)
 		file = [options.filename[0],options.filename[0]]
 		file[0] = options.filename[1] + str(int(entry)) + '_step_'+ str(options.step) + '_sweeped_tone.dat'
 		cal_tone_save.write(file[0]+'\n')
+		tones.append((int(entry), file[0]))
 		print("Sending calibration tone at " + str(entry.strip()) + " Hz")
 		if options.mode == 2:
-			raw_input("Press Enter to start capture of tone at "+ str(entry.strip()) + " Hz\n")
+			input("Press Enter to start capture of tone at "+ str(entry.strip()) + " Hz\n")
 		start_time = time.time()
 		print("Start Time: " + str(start_time))
 		if(options.mode == 2):
-			dummy_a=raw_input("Press Enter to continue... "+file[0]+"\n")
+			dummy_a=input("Press Enter to continue... "+file[0]+"\n")
 		tb = top_block_cls(options,file)
 		tb.start()
 		tb.wait()
@@ -696,9 +832,7 @@ def calibrate(options,top_block_cls = cal_block):
 	print("Calibration capture complete")
 	cal_tone_save.close()
 	cal_tone_list.close()
-	filename1[0] = options.filename[0][0:-4]+'_op.txt'
-	filename1[1] = options.filename[1]+'combined_rt_cal.dat'
-	combine_cal(options,filename1)
+	return tones
 
 def combine_cal(options,filename,top_block_cls=comb_block):
 	"""Wrapper function for combining multiple calibration sample files.
@@ -849,6 +983,32 @@ def sweep(options,top_block_cls = sweep_block):
 		17. txfreq: Transmitter frequency for all transmit chains (float)
 
 		18. txsamp: Transmitter sampling frequency wherever applicable (float)
+
+		19. stream_addr: Also publish the sweeps (modes 3 and 30) to this address. (str, optional)
+			'udp://<host>:<port>' for UDP, any other ZeroMQ address (e.g. 'tcp://*:5555') for a PUB socket.
+
+		20. stream_format: Sample format of the stream, 'fc32', 'sc16' or 'sc8'. (str, default 'fc32')
+
+		21. stream_batch: Sweeps per stream message. (int, default 1)
+
+		22. stream_datagram: Largest UDP datagram in bytes. (int, default 8192 plus the header)
+
+		23. cal_compact: Hold the calibration (modes 1 and 3) as 16 bit phase codes instead of
+			complex phasors. (bool, default False) The codes need a shared 512 KB lookup table,
+			so this only saves memory for calibrations of more than about 87k samples.
+
+		24. tune: Size the UHD receive buffers and block buffers from the sweep
+			plan. (bool, default False) See stream_tuning() and tune_flowgraph() for the
+			tune_buffer_time, tune_frame_size, tune_affinity and tune_realtime attributes.
+
+		25. channels: Also write narrow channels (modes 3 and 30) to options.chan_dir. (list, optional)
+			See channelize() for channels, vco_table, cal_tones and the other chan_ attributes.
+
+		26. archive: Save modes 3 and 30 as a compressed capture archive. (bool, default False)
+			See archive_writer for the archive_ attributes.
+
+		27. burst_log: Also label bursts (modes 3 and 30) as WiFi, Bluetooth or other and write
+			them to this CSV file. (str, optional) See classify_bursts() for the burst_ attributes.
 	"""
 
 	start_time = time.time()
@@ -923,3 +1083,2273 @@ def demo_init():
 
 	print("Demo Init Complete.")
 	return [cal_opt,sweep_opt]
+
+def _is_archive(filename):
+	"""True if filename is a capture archive written by archive_writer."""
+	handle = open(filename, 'rb')
+	magic = handle.read(len(ARCHIVE_MAGIC))
+	handle.close()
+	return magic == ARCHIVE_MAGIC
+
+def _capture_frames(filename, frame_len):
+	"""Memory-maps a raw fc32 capture as an array of whole sweeps.
+
+	Input: filename (string), frame_len (samples in one sweep of all bands)
+	Returns: read-only array of shape (num_sweeps, frame_len)
+
+	Trailing samples that do not make up a whole sweep are dropped. Compressed capture
+	archives are opened with archive_reader, which supports len() and sweep slices.
+	"""
+	if _is_archive(filename):
+		reader = archive_reader(filename)
+		if reader.frame_len != frame_len:
+			stderr.write("Error: archive %s holds sweeps of %d samples, expected %d\n" % (filename, reader.frame_len, frame_len))
+			exit(1)
+		return reader
+	num_sweeps = os.path.getsize(filename)//(8*frame_len)
+	if num_sweeps == 0:
+		return np.zeros((0, frame_len), dtype=np.complex64)
+	data = np.memmap(filename, dtype=np.complex64, mode='r', shape=(num_sweeps*frame_len,))
+	return data.reshape(num_sweeps, frame_len)
+
+def _close_frames(frames):
+	"""Releases what _capture_frames() opened (the decoder threads of an archive)."""
+	if isinstance(frames, archive_reader):
+		frames.close()
+
+def _band_psd(frames, options, nfft):
+	"""Welch power spectral density of every band in every sweep.
+
+	Input: frames (num_sweeps x num_bands*sweep_time complex array), options, nfft (int)
+	Returns: float32 array of shape (num_sweeps, num_bands, nfft), linear power, DC centered
+	"""
+	num_seg = options.sweep_time//nfft
+	window = np.hanning(nfft).astype(np.float32)
+	window = window/np.sqrt(np.sum(window**2))
+	x = np.asarray(frames).reshape(len(frames), options.num_bands, options.sweep_time)
+	x = x[:, :, :num_seg*nfft].reshape(len(frames), options.num_bands, num_seg, nfft)
+	p = np.abs(np.fft.fft(x*window, axis=-1))**2
+	return np.fft.fftshift(p.mean(axis=2), axes=-1).astype(np.float32)
+
+def _read_manifest(path):
+	"""Lists (capture, calibration) pairs from a directory or a manifest file.
+
+	A directory yields every '.dat' (raw) and '.ssz' (archive) file in it. A manifest is a text file with
+	one capture per line, optionally followed by a comma and the calibration
+	file for that capture.
+	"""
+	if os.path.isdir(path):
+		names = sorted(f for f in os.listdir(path) if f.endswith('.dat') or f.endswith('.ssz'))
+		return [(os.path.join(path, f), None) for f in names]
+	entries = []
+	manifest = open(path, "r")
+	for line in manifest.readlines():
+		fields = [f.strip() for f in line.split(',')]
+		if fields[0] == '':
+			continue
+		entries.append((fields[0], fields[1] if len(fields) > 1 and fields[1] else None))
+	manifest.close()
+	return entries
+
+_reprocess_cal = {}
+
+def _occupancy_floor(capture, cal_file, options, nfft):
+	"""Noise floor of every band of a capture, for reprocess(options.reprocess='occupancy').
+
+	Returns options.noise_floor if it is set, otherwise the median PSD of up to
+	options.floor_sweeps sweeps spread evenly over the whole capture, so the floor does
+	not depend on how the capture is split into chunks.
+	Returns: float32 array of shape (1, num_bands, 1)
+	"""
+	if getattr(options, 'noise_floor', None) is not None:
+		floor = np.zeros(options.num_bands, dtype=np.float32)+np.asarray(options.noise_floor, dtype=np.float32)
+		return floor.reshape(1, options.num_bands, 1)
+	frame_len = options.sweep_time*options.num_bands
+	frames = _capture_frames(capture, frame_len)
+	picks = np.unique(np.linspace(0, len(frames)-1, min(len(frames), getattr(options, 'floor_sweeps', 256))).astype(np.int64))
+	sample = np.concatenate([frames[k:k+1] for k in picks])
+	_close_frames(frames)
+	if cal_file is not None:
+		sample = sample*np.conj(np.fromfile(cal_file, dtype=np.complex64, count=frame_len))
+	return np.median(_band_psd(sample, options, nfft), axis=(0, 2), keepdims=True)
+
+def _reprocess_signature(capture, cal_file, options, nfft, chunk_sweeps):
+	"""One line describing a reprocess() job, saved at the top of its checkpoint."""
+	def stamp(path):
+		return None if path is None else [os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)]
+	noise_floor = getattr(options, 'noise_floor', None)
+	job = {'reprocess': options.reprocess, 'capture': stamp(capture), 'cal': stamp(cal_file),
+		'sweep_time': options.sweep_time, 'num_bands': options.num_bands, 'chunk_sweeps': chunk_sweeps}
+	if options.reprocess != 'unsweep':
+		job['nfft'] = nfft
+	if options.reprocess == 'occupancy':
+		job['threshold'] = getattr(options, 'threshold', 10.0)
+		job['noise_floor'] = None if noise_floor is None else np.atleast_1d(noise_floor).astype(float).tolist()
+		job['floor_sweeps'] = getattr(options, 'floor_sweeps', 256)
+	return 'job '+json.dumps(job, sort_keys=True)
+
+def _reprocess_chunk(task):
+	"""Process pool worker for reprocess(). Handles one sweep-aligned chunk."""
+	(job, chunk, first, count, capture, cal_file, out_file, floor, options) = task
+	frame_len = options.sweep_time*options.num_bands
+	source = _capture_frames(capture, frame_len)
+	frames = source[first:first+count]
+	if cal_file is not None:
+		if cal_file not in _reprocess_cal:
+			_reprocess_cal[cal_file] = np.conj(np.fromfile(cal_file, dtype=np.complex64, count=frame_len))
+		frames = frames*_reprocess_cal[cal_file]
+	if options.reprocess == 'unsweep':
+		out = np.memmap(out_file, dtype=np.complex64, mode='r+', offset=8*first*frame_len, shape=(count, frame_len))
+		out[:] = frames
+	else:
+		nfft = getattr(options, 'nfft', 256)
+		psd = _band_psd(frames, options, nfft)
+		out = np.lib.format.open_memmap(out_file, mode='r+')
+		if options.reprocess == 'psd':
+			out[first:first+count] = psd
+		else:
+			out[first:first+count] = psd > floor*10**(getattr(options, 'threshold', 10.0)/10.0)
+	out.flush()
+	del out
+	_close_frames(source)
+	return (job, chunk)
+
+def reprocess(options):
+	"""Offline batch reprocessing of capture archives.
+
+	Inputs:
+		1. options (object)
+	Outputs:
+		None
+
+	Splits every capture into chunks of whole sweeps and processes the chunks on a
+	process pool. Captures are memory-mapped, so workers only touch the sweeps they
+	are given. Every finished chunk is recorded in a '.ckpt' file next to its output;
+	calling reprocess() again with the same options resumes an interrupted job. A checkpoint
+	written for other settings (mode, calibration, capture, nfft, threshold, noise floor or
+	chunk_sweeps) is discarded and that capture is processed again from the start.
+
+	Attributes of options:
+		1. filename: List of path strings. (list)
+
+			[<captures>, <calibration_file>, <output_folder>]
+
+			<captures> (str)
+				Folder of raw fc32 captures (mode 30), or a manifest text file with one
+				capture per line as '<capture>[,<calibration_file>]'.
+
+			<calibration_file> (str)
+				Combined calibration used for captures without one in the manifest.
+				Empty string to process the samples as they are.
+
+			<output_folder> (str)
+				Folder where the results and checkpoints are written.
+
+		2. reprocess: Processing to apply to each capture. (str)
+
+			'unsweep': Compensate with the calibration, written as '<name>_unswept.dat' (fc32).
+			'psd': Per-band PSD of every sweep, written as '<name>_psd.npy'
+			(num_sweeps x num_bands x nfft, float32).
+			'occupancy': PSD bins above threshold, written as '<name>_occ.npy' (same shape, bool).
+
+			Captures are compensated before 'psd' and 'occupancy' if a calibration is given.
+
+		3. num_bands: Total number of VCO bands enabled in both band1 and band2. (int)
+			Can be computed using the step_size_metrics() function.
+
+		4. sweep_time: Number of samples per voltage sweep. (int)
+			Can be computed using the step_size_metrics() function.
+
+		5. nfft: FFT size for 'psd' and 'occupancy' (int, default 256)
+
+		6. threshold: Occupancy threshold in dB above the noise floor of each band (float, default 10)
+
+			The noise floor is the median PSD of each band over up to floor_sweeps sweeps
+			(int, default 256) spread over the capture, or noise_floor if it is set (linear
+			PSD power, float or one per band).
+
+		7. chunk_sweeps: Number of sweeps handed to a worker at a time (int, default 64)
+			It is saved in the checkpoint, and a job is only resumed with the same value.
+
+		8. workers: Size of the process pool (int, default is the number of cores)
+	"""
+	frame_len = options.sweep_time*options.num_bands
+	chunk_sweeps = getattr(options, 'chunk_sweeps', 64)
+	suffix = {'unsweep': '_unswept.dat', 'psd': '_psd.npy', 'occupancy': '_occ.npy'}[options.reprocess]
+	nfft = getattr(options, 'nfft', 256)
+	if not os.path.isdir(options.filename[2]):
+		os.makedirs(options.filename[2])
+
+	tasks = []
+	checkpoints = {}
+	for (job, (capture, cal_file)) in enumerate(_read_manifest(options.filename[0])):
+		if cal_file is None and options.filename[1] != '':
+			cal_file = options.filename[1]
+		if cal_file is not None and os.path.getsize(cal_file) != 8*frame_len:
+			print("Calibration "+cal_file+" does not match the sweep length of "+str(frame_len)+" samples. Exiting")
+			exit(-1)
+		if cal_file is None and options.reprocess == 'unsweep':
+			print("No calibration for "+capture+". Exiting")
+			exit(-1)
+		source = _capture_frames(capture, frame_len)
+		num_sweeps = len(source)
+		_close_frames(source)
+		if num_sweeps == 0:
+			print("Skipping "+capture+": shorter than one sweep")
+			continue
+		name = os.path.splitext(os.path.basename(capture))[0]
+		out_file = os.path.join(options.filename[2], name+suffix)
+
+		# resume from the checkpoint if the output survived and was made by the same job
+		signature = _reprocess_signature(capture, cal_file, options, nfft, chunk_sweeps)
+		done = None
+		ckpt_file = out_file+'.ckpt'
+		if os.path.exists(out_file) and os.path.exists(ckpt_file):
+			ckpt = open(ckpt_file, "r")
+			lines = [line.strip() for line in ckpt.readlines() if line.strip() != '']
+			ckpt.close()
+			if len(lines) > 0 and lines[0] == signature:
+				done = set(int(line) for line in lines[1:])
+			else:
+				print("Checkpoint "+ckpt_file+" belongs to a different job, starting over")
+		if done is None:
+			done = set()
+			if options.reprocess == 'unsweep':
+				out = np.memmap(out_file, dtype=np.complex64, mode='w+', shape=(num_sweeps*frame_len,))
+			else:
+				out = np.lib.format.open_memmap(out_file, mode='w+',
+					dtype=np.float32 if options.reprocess == 'psd' else np.bool_,
+					shape=(num_sweeps, options.num_bands, nfft))
+			del out
+			ckpt = open(ckpt_file, "w")
+			ckpt.write(signature+'\n')
+			ckpt.close()
+		checkpoints[job] = open(ckpt_file, "a")
+		floor = _occupancy_floor(capture, cal_file, options, nfft) if options.reprocess == 'occupancy' else None
+
+		for (chunk, first) in enumerate(range(0, num_sweeps, chunk_sweeps)):
+			if chunk not in done:
+				count = min(chunk_sweeps, num_sweeps-first)
+				tasks.append((job, chunk, first, count, capture, cal_file, out_file, floor, options))
+		print("Queued "+capture+": "+str(num_sweeps)+" sweeps, "+str(len(done))+" chunks already done")
+
+	start_time = time.time()
+	pool = multiprocessing.Pool(getattr(options, 'workers', None))
+	finished = 0
+	for (job, chunk) in pool.imap_unordered(_reprocess_chunk, tasks):
+		checkpoints[job].write(str(chunk)+'\n')
+		checkpoints[job].flush()
+		finished = finished+1
+	pool.close()
+	pool.join()
+	for ckpt in checkpoints.values():
+		ckpt.close()
+	end_time = time.time()
+	print("Reprocessed "+str(finished)+" chunks in "+str(end_time - start_time)+" seconds")
+
+def read_meta_headers(filename):
+	"""Reads the headers written by a file_meta_sink (such as the one in cal_block).
+
+	Input: filename (string) of the data file. Detached headers are read from filename+'.hdr'.
+	Returns: List of dictionaries, one per segment, as given by parse_file_metadata
+	(rx_rate, rx_time, nitems, ...). Extra dictionary entries are merged in.
+	"""
+	hdr_name = filename+'.hdr'
+	detached = os.path.exists(hdr_name)
+	handle = open(hdr_name if detached else filename, 'rb')
+	headers = []
+	while True:
+		hdr_str = handle.read(parse_file_metadata.HEADER_LENGTH)
+		if len(hdr_str) < parse_file_metadata.HEADER_LENGTH:
+			break
+		info = parse_file_metadata.parse_header(pmt.deserialize_str(hdr_str), False)
+		if info["extra_len"] > 0:
+			extra_str = handle.read(info["extra_len"])
+			if len(extra_str) < info["extra_len"]:
+				break
+			info = parse_file_metadata.parse_extra_dict(pmt.deserialize_str(extra_str), info, False)
+		headers.append(info)
+		if not detached:
+			handle.seek(info["nbytes"], 1)
+	handle.close()
+	return headers
+
+class replay_block(gr.top_block):
+
+	def __init__(self,options,consumer=None):
+		gr.top_block.__init__(self, "Top Block")
+
+		##################################################
+		# Blocks
+		##################################################
+		frame_len = options.sweep_time*options.num_bands
+		replay_rate = getattr(options, 'replay_rate', 1.0)
+		repeat = getattr(options, 'replay_repeat', False)
+
+		num_items = os.path.getsize(options.filename[0])//8
+		# Captures from cal_block carry their own rate and timing in a file_meta_sink header
+		if _is_archive(options.filename[0]):
+			# compressed capture archives are decoded on the fly
+			self.blocks_file_source_0 = archive_source(options.filename[0], repeat)
+			self.samp = self.blocks_file_source_0.reader.header['samp'] or options.samp
+			num_items = len(self.blocks_file_source_0.reader)*frame_len
+		elif os.path.exists(options.filename[0]+'.hdr'):
+			headers = read_meta_headers(options.filename[0])
+			self.samp = headers[0]["rx_rate"] if len(headers) > 0 else options.samp
+			self.blocks_file_source_0 = blocks.file_meta_source(options.filename[0], repeat, True, options.filename[0]+'.hdr')
+		else:
+			self.samp = options.samp
+			self.blocks_file_source_0 = blocks.file_source(gr.sizeof_gr_complex*1, options.filename[0], repeat)
+
+		# Skip and head keep the replay sweep aligned, like the capture flowgraphs
+		skip = int(getattr(options, 'skip', 0)/frame_len)*frame_len
+		self.blocks_skiphead_0 = blocks.skiphead(gr.sizeof_gr_complex*1, skip)
+		if repeat:
+			self.blocks_head_0 = blocks.head(gr.sizeof_gr_complex*1, options.maxsamp)
+		else:
+			self.blocks_head_0 = blocks.head(gr.sizeof_gr_complex*1, int((num_items-skip)/frame_len)*frame_len)
+
+		# Mark the start of every sweep with a 'sweep' length tag
+		self.blocks_stream_to_tagged_stream_0 = blocks.stream_to_tagged_stream(gr.sizeof_gr_complex, 1, frame_len, "sweep")
+
+		if consumer is None:
+			consumer = blocks.null_sink(gr.sizeof_gr_complex*1)
+		self.consumer = consumer
+
+		##################################################
+		# Connections
+		##################################################
+		self.connect((self.blocks_file_source_0, 0), (self.blocks_skiphead_0, 0))
+		self.connect((self.blocks_skiphead_0, 0), (self.blocks_head_0, 0))
+		if replay_rate > 0:
+			# replay_rate 0 runs as fast as the consumer allows. Only one sweep in every inN
+			# was kept, so kept samples are replayed inN times slower than the sample rate.
+			self.blocks_throttle_0 = blocks.throttle(gr.sizeof_gr_complex*1, self.samp*replay_rate/getattr(options, 'inN', 1), True)
+			self.connect((self.blocks_head_0, 0), (self.blocks_throttle_0, 0))
+			self.connect((self.blocks_throttle_0, 0), (self.blocks_stream_to_tagged_stream_0, 0))
+		else:
+			self.connect((self.blocks_head_0, 0), (self.blocks_stream_to_tagged_stream_0, 0))
+		self.connect((self.blocks_stream_to_tagged_stream_0, 0), (self.consumer, 0))
+
+def replay(options,consumer=None,top_block_cls=replay_block):
+	"""Replays a recorded capture into a consumer at its original sample rate (or faster).
+
+	Inputs:
+		1. options (object)
+		2. consumer: GNURadio block (or hier block) with one complex input. (default null_sink)
+		3. top_block_cls (default is replay_block)
+	Outputs:
+		Replay speed as a multiple of real time (float)
+
+	The replayed stream has the same shape as the output of sweep_block: whole sweeps of
+	num_bands*sweep_time samples, with a 'sweep' tag at the start of each. Captures saved by
+	cal_block are read with their file_meta_sink headers, so the rx_time/rx_rate tags of the
+	original capture are reproduced. Capture archives are decoded as they are replayed.
+	Set replay_rate to 0 to measure how much faster than
+	real time a consumer can run.
+
+	Attributes of options:
+		1. filename: [<path_to_capture>] (list)
+
+		2. maxsamp: Number of samples to replay when replay_repeat is set. (int)
+
+		3. inN: Sweep subsampling used for the capture (one sweep kept in every inN). Sets
+			the real time rate of the replay. (int, default 1)
+
+		4. num_bands: Total number of VCO bands enabled in both band1 and band2. (int)
+
+		5. replay_rate: Multiple of the capture sample rate to replay at. (float, default 1.0)
+			0 replays as fast as possible.
+
+		6. replay_repeat: Loop over the capture until maxsamp samples are replayed. (bool, default False)
+
+		7. samp: Sampling rate of the capture. Only used if it has no header. (int)
+
+		8. skip: Number of samples to skip at the start of the capture. Rounded down to whole sweeps. (int)
+
+		9. sweep_time: Number of samples per voltage sweep. (int)
+	"""
+	tb = top_block_cls(options,consumer)
+	start_time = time.time()
+	tb.start()
+	tb.wait()
+	end_time = time.time()
+	nitems = tb.blocks_head_0.nitems_written(0)
+	speed = (nitems*getattr(options, 'inN', 1)/float(tb.samp))/(end_time - start_time)
+	print("Replayed "+str(nitems)+" samples ("+str(nitems//(options.sweep_time*options.num_bands))+" sweeps) in "+str(end_time - start_time)+" seconds")
+	print("Replay speed: "+str(speed)+" x real time")
+	return speed
+
+# Frame header for sweep_stream_sink / sweep_stream_receiver:
+# magic, version, sample format, message sequence number, first sweep number, sweeps in message,
+# sweep stride (inN), frame length, band1, band2, rf_div, step, sample rate, timestamp of the
+# first sample, sample scale, fragment index, fragment count
+STREAM_HEADER = struct.Struct('!4sHHQQHHIIIHHddfII')
+STREAM_FIELDS = ['magic', 'version', 'format', 'seq', 'sweep', 'num_sweeps', 'stride', 'frame_len', 'band1',
+	'band2', 'rf_div', 'step', 'samp', 'timestamp', 'scale', 'frag', 'num_frags']
+STREAM_MAGIC = b'SWSS'
+STREAM_FORMATS = {'fc32': 0, 'sc16': 1, 'sc8': 2}
+
+def _stream_encode(x, fmt):
+	"""Encodes complex64 samples as fc32, sc16 or sc8. Returns (uint8 array, scale)."""
+	if fmt == 0:
+		return (x.view(np.uint8), 1.0)
+	full_scale = 32767.0 if fmt == 1 else 127.0
+	iq = x.view(np.float32)
+	peak = float(np.max(np.abs(iq))) if len(iq) > 0 else 0.0
+	scale = peak/full_scale if peak > 0 else 1.0
+	return (np.rint(iq/scale).astype(np.int16 if fmt == 1 else np.int8).view(np.uint8), scale)
+
+def _stream_decode(payload, fmt, scale):
+	"""Decodes a payload produced by _stream_encode back to complex64."""
+	if fmt == 0:
+		return np.frombuffer(payload, dtype=np.complex64).copy()
+	iq = np.frombuffer(payload, dtype=np.int16 if fmt == 1 else np.int8).astype(np.float32)*np.float32(scale)
+	return iq.view(np.complex64)
+
+def _stream_endpoint(addr):
+	"""Splits 'udp://host:port' into (host, port). Returns None for ZeroMQ addresses."""
+	if not addr.startswith('udp://'):
+		return None
+	(host, port) = addr[len('udp://'):].rsplit(':', 1)
+	return (host, int(port))
+
+class sweep_stream_sink(gr.sync_block):
+	"""Publishes whole sweeps over UDP or a ZeroMQ PUB socket.
+
+	Each message holds stream_batch sweeps behind a STREAM_HEADER. UDP messages are split
+	into datagrams of at most stream_datagram bytes; ZeroMQ messages are sent whole as
+	[header, payload]. Use sweep_stream_receiver on the other end.
+	"""
+
+	def __init__(self,options):
+		gr.sync_block.__init__(self, name="sweep_stream_sink", in_sig=[np.complex64], out_sig=None)
+		self.frame_len = options.sweep_time*options.num_bands
+		self.batch = getattr(options, 'stream_batch', 1)
+		self.fmt = STREAM_FORMATS[getattr(options, 'stream_format', 'fc32')]
+		self.stride = getattr(options, 'inN', 1)
+		self.samp = float(options.samp)
+		self.plan = [options.band1, options.band2, options.rf_div, options.step]
+		self.buffer = np.zeros(self.batch*self.frame_len, dtype=np.complex64)
+		self.fill = 0
+		self.seq = 0
+		self.sweep = 0
+		self.time_ref = None
+
+		self.endpoint = _stream_endpoint(options.stream_addr)
+		if self.endpoint is not None:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64*1024*1024)
+			self.sock.connect(self.endpoint)
+			self.datagram = getattr(options, 'stream_datagram', 8192+STREAM_HEADER.size)-STREAM_HEADER.size
+		else:
+			if zmq is None:
+				stderr.write("Error: pyzmq is needed to stream to %s\n" % options.stream_addr)
+				exit(1)
+			self.context = zmq.Context()
+			self.sock = self.context.socket(zmq.PUB)
+			self.sock.setsockopt(zmq.SNDHWM, 64)
+			self.sock.bind(options.stream_addr)
+
+	def _send(self, offset, sweeps):
+		# rx_time tags from the USRP anchor the clock, otherwise the host clock is used.
+		# Only one sweep in every stride reaches this block, so kept samples are scaled by stride.
+		if self.time_ref is None:
+			self.time_ref = (offset, time.time())
+		timestamp = self.time_ref[1]+(offset-self.time_ref[0])*self.stride/self.samp
+		(payload, scale) = _stream_encode(self.buffer[:sweeps*self.frame_len], self.fmt)
+		if self.fmt == 0:
+			# the buffer is refilled by the next work() while ZeroMQ may still be sending it
+			payload = payload.copy()
+		header = [STREAM_MAGIC, 1, self.fmt, self.seq, self.sweep, sweeps, self.stride, self.frame_len]
+		header = header+self.plan+[self.samp, timestamp, scale]
+		if self.endpoint is None:
+			self.sock.send_multipart([STREAM_HEADER.pack(*(header+[0, 1])), payload], copy=False)
+		else:
+			view = memoryview(payload)
+			count = (len(view)+self.datagram-1)//self.datagram
+			for frag in range(count):
+				self.sock.sendmsg([STREAM_HEADER.pack(*(header+[frag, count])), view[frag*self.datagram:(frag+1)*self.datagram]])
+		self.seq = self.seq+1
+		self.sweep = self.sweep+sweeps*self.stride
+
+	def work(self, input_items, output_items):
+		x = input_items[0]
+		start = self.nitems_read(0)
+		for tag in self.get_tags_in_window(0, 0, len(x), pmt.intern("rx_time")):
+			secs = pmt.to_uint64(pmt.tuple_ref(tag.value, 0))+pmt.to_double(pmt.tuple_ref(tag.value, 1))
+			self.time_ref = (tag.offset, secs)
+		used = 0
+		while used < len(x):
+			n = min(len(x)-used, len(self.buffer)-self.fill)
+			self.buffer[self.fill:self.fill+n] = x[used:used+n]
+			self.fill = self.fill+n
+			used = used+n
+			if self.fill == len(self.buffer):
+				self._send(start+used-len(self.buffer), self.batch)
+				self.fill = 0
+		return len(x)
+
+	def stop(self):
+		# the last message carries the whole sweeps of a partial batch
+		if self.fill >= self.frame_len:
+			self._send(self.nitems_read(0)-self.fill, self.fill//self.frame_len)
+		self.sock.close()
+		return True
+
+class sweep_stream_receiver(object):
+	"""Receives sweeps published by sweep_stream_sink.
+
+	Input: addr (string), 'udp://<bind_host>:<port>' or a ZeroMQ address to subscribe to.
+
+	recv() returns (header, samples) for the next complete message, where header is a
+	dictionary of the STREAM_HEADER fields and samples has shape (num_sweeps, frame_len).
+	Lost messages, including UDP messages with missing fragments, are counted in
+	lost_sweeps and listed in gaps as (first_lost_sweep, num_lost_sweeps).
+	"""
+
+	def __init__(self,addr):
+		self.endpoint = _stream_endpoint(addr)
+		if self.endpoint is not None:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64*1024*1024)
+			self.sock.bind(self.endpoint)
+			self.datagram = bytearray(65536)
+		else:
+			if zmq is None:
+				stderr.write("Error: pyzmq is needed to subscribe to %s\n" % addr)
+				exit(1)
+			self.context = zmq.Context()
+			self.sock = self.context.socket(zmq.SUB)
+			self.sock.setsockopt(zmq.SUBSCRIBE, b'')
+			self.sock.connect(addr)
+		self.next_seq = None
+		self.next_sweep = None
+		self.lost_sweeps = 0
+		self.gaps = []
+		# reassembly state for the UDP message in progress
+		self.header = None
+		self.payload = None
+		self.frags = 0
+
+	def _deliver(self, header, payload):
+		if self.next_seq is not None and header['seq'] > self.next_seq:
+			lost = (header['sweep']-self.next_sweep)//header['stride']
+			self.lost_sweeps = self.lost_sweeps+lost
+			self.gaps.append((self.next_sweep, lost))
+		self.next_seq = header['seq']+1
+		self.next_sweep = header['sweep']+header['num_sweeps']*header['stride']
+		samples = _stream_decode(payload, header['format'], header['scale'])
+		return (header, samples.reshape(header['num_sweeps'], header['frame_len']))
+
+	def recv(self):
+		"""Blocks until the next complete message and returns (header, samples)."""
+		if self.endpoint is None:
+			(hdr, payload) = self.sock.recv_multipart(copy=False)
+			return self._deliver(dict(zip(STREAM_FIELDS, STREAM_HEADER.unpack(hdr.buffer))), payload.buffer)
+		while True:
+			n = self.sock.recv_into(self.datagram)
+			if n < STREAM_HEADER.size:
+				continue
+			header = dict(zip(STREAM_FIELDS, STREAM_HEADER.unpack_from(self.datagram)))
+			if header['magic'] != STREAM_MAGIC:
+				continue
+			if self.header is None or header['seq'] != self.header['seq']:
+				# a new message replaces whatever was still being reassembled
+				itemsize = [8, 4, 2][header['format']]
+				self.header = header
+				self.payload = bytearray(header['num_sweeps']*header['frame_len']*itemsize)
+				self.frags = 0
+			# every fragment but the last has the full datagram size
+			size = n-STREAM_HEADER.size
+			if header['frag'] == header['num_frags']-1:
+				offset = len(self.payload)-size
+			else:
+				offset = header['frag']*size
+			self.payload[offset:offset+size] = self.datagram[STREAM_HEADER.size:n]
+			self.frags = self.frags+1
+			if self.frags == header['num_frags']:
+				self.header = None
+				return self._deliver(header, self.payload)
+
+	def close(self):
+		self.sock.close()
+
+def _band_list(options):
+	"""Returns the indices of the enabled VCO bands in sweep order (band1 bits are 0-31, band2 bits 32 and up)."""
+	return [b for b in range(32) if (options.band1 >> b) & 1]+[32+b for b in range(32) if (options.band2 >> b) & 1]
+
+def _pool2(a, how):
+	"""2x2 max or mean pooling. Odd edges are pooled with a copy of the last row/column."""
+	a = np.pad(a, ((0, a.shape[0] % 2), (0, a.shape[1] % 2)), mode='edge')
+	a = a.reshape(a.shape[0]//2, 2, a.shape[1]//2, 2)
+	return a.max(axis=(1, 3)) if how == 'max' else a.mean(axis=(1, 3))
+
+def build_pyramid(options):
+	"""Builds a multi-resolution waterfall (PSD pyramid) for a capture.
+
+	Inputs:
+		1. options (object)
+	Outputs:
+		None
+
+	Level 0 holds one row per sweep. With a VCO table its columns are a fixed RF grid (one
+	bin per samp/nfft, see rf_grid), so every column is a true RF frequency even though the
+	LO sweeps across each band. Without one, the columns are the baseband PSD of every band
+	over its whole dwell (num_bands*nfft columns, band major, DC centered within a band),
+	which has no single RF frequency per column. Each further level halves both axes with
+	max and mean pooling, until a level fits in one tile. All levels are written in a single
+	streaming pass over the capture. Open the result with waterfall_pyramid.
+
+	Attributes of options:
+		1. band1, band2: Bitmaps of the VCO bands in the capture. (int32)
+
+		2. filename: [<path_to_capture>, <output_folder>, <path_to_calibration_data>] (list)
+			The calibration is optional and only needed for uncompensated (mode 30) captures.
+
+		3. inN: Sweep subsampling used for the capture. (int)
+
+		4. nfft: FFT size per band. (int, default 256)
+
+		5. num_bands, sweep_time: As computed by step_size_metrics(). (int)
+
+		6. rf_div, step, samp: Capture settings, saved with the pyramid. (int)
+
+		7. tile: Size of the coarsest level along either axis. (int, default 256)
+
+		8. vco_table: VCO table from characterize_vco(), optional. Builds level 0 on an RF grid
+			so the pyramid can be queried by RF frequency.
+
+		9. cal_tones: Calibration tone list. Needed with vco_table for compensated captures
+			(mode 3, or when a calibration is given), whose samples are referenced to the tones.
+
+		10. pyramid_usable: Fraction of the baseband used for the RF grid. (float, default 0.8)
+	"""
+	frame_len = options.sweep_time*options.num_bands
+	nfft = getattr(options, 'nfft', 256)
+	tile = getattr(options, 'tile', 256)
+	frames = _capture_frames(options.filename[0], frame_len)
+	cal = None
+	if len(options.filename) > 2 and options.filename[2] != '':
+		cal = np.conj(np.fromfile(options.filename[2], dtype=np.complex64, count=frame_len))
+	grid = None
+	if getattr(options, 'vco_table', None):
+		tones = _cal_tone_list(options)
+		if cal is not None and tones is None:
+			stderr.write("Error: an RF pyramid of a compensated capture needs options.cal_tones\n")
+			exit(1)
+		grid = rf_grid(options, load_vco_table(options.vco_table, options), tones, nfft, getattr(options, 'pyramid_usable', 0.8))
+
+	rows = len(frames)
+	cols = grid.num_grid if grid is not None else options.num_bands*nfft
+	levels = 1
+	while (rows > tile or cols > tile) and rows > 1:
+		rows = (rows+1)//2
+		cols = (cols+1)//2
+		levels = levels+1
+	chunk_sweeps = max(64, 2**(levels-1))
+
+	if not os.path.isdir(options.filename[1]):
+		os.makedirs(options.filename[1])
+	shapes = []
+	out = []
+	(rows, cols) = (len(frames), grid.num_grid if grid is not None else options.num_bands*nfft)
+	for k in range(levels):
+		shapes.append([rows, cols])
+		out.append(dict((how, np.lib.format.open_memmap(os.path.join(options.filename[1], 'level_%d_%s.npy' % (k, how)),
+			mode='w+', dtype=np.float32, shape=(rows, cols))) for how in ['max', 'mean']))
+		(rows, cols) = ((rows+1)//2, (cols+1)//2)
+
+	start_time = time.time()
+	for first in range(0, len(frames), chunk_sweeps):
+		block = frames[first:first+chunk_sweeps]
+		if cal is not None:
+			block = block*cal
+		if grid is not None:
+			psd = grid.spectrum(block).astype(np.float32)
+		else:
+			psd = _band_psd(block, options, nfft).reshape(len(block), -1)
+		level = {'max': psd, 'mean': psd}
+		for k in range(levels):
+			row = first//2**k
+			for how in ['max', 'mean']:
+				if k > 0:
+					level[how] = _pool2(level[how], how)
+				out[k][how][row:row+len(level[how])] = level[how]
+
+	_close_frames(frames)
+	for k in range(levels):
+		for how in ['max', 'mean']:
+			out[k][how].flush()
+	meta = {'version': 2, 'axis': 'rf' if grid is not None else 'baseband', 'nfft': nfft, 'levels': shapes, 'bands': _band_list(options),
+		'band1': options.band1, 'band2': options.band2, 'rf_div': options.rf_div, 'step': options.step,
+		'samp': options.samp, 'sweep_period': frame_len*getattr(options, 'inN', 1)/float(options.samp)}
+	if grid is not None:
+		(meta['f_min'], meta['df']) = (grid.f_min, grid.df)
+	meta_file = open(os.path.join(options.filename[1], 'pyramid.json'), 'w')
+	json.dump(meta, meta_file)
+	meta_file.close()
+	print("Built "+str(levels)+" level pyramid for "+str(len(frames))+" sweeps in "+str(time.time()-start_time)+" seconds")
+
+class waterfall_pyramid(object):
+	"""Query interface for a pyramid written by build_pyramid().
+
+	Input: path (string) to the pyramid folder.
+
+	query(t0, t1, f0, f1, rows, cols, how) returns the window between t0 and t1 seconds and
+	frequencies f0 to f1, from the coarsest level that still has at least rows x cols points
+	in the window ('max' or 'mean' pooling). Pyramids built with a VCO table take RF
+	frequencies in Hz; the others take (band, baseband Hz) pairs, with the VCO band index as
+	in band1/band2. Returns (psd, level, time_axis, freq_axis): the start time of each row
+	and the frequency of each column, RF (Hz) or baseband (Hz) within its band.
+	Levels are memory mapped, so a query only reads the requested window.
+	"""
+
+	def __init__(self,path):
+		meta_file = open(os.path.join(path, 'pyramid.json'), 'r')
+		self.meta = json.load(meta_file)
+		meta_file.close()
+		self.levels = [dict((how, np.load(os.path.join(path, 'level_%d_%s.npy' % (k, how)), mmap_mode='r'))
+			for how in ['max', 'mean']) for k in range(len(self.meta['levels']))]
+
+	def column(self, freq):
+		"""Level 0 column of an RF frequency in Hz (RF pyramids) or of a (band, baseband Hz) pair."""
+		nfft = self.meta['nfft']
+		bands = self.meta['bands']
+		if self.meta.get('axis') == 'rf':
+			if isinstance(freq, tuple):
+				raise ValueError("this pyramid is on an RF grid; query RF frequencies in Hz")
+			return int(np.clip(np.floor((freq-self.meta['f_min'])/self.meta['df']+0.5), 0, self.meta['levels'][0][1]-1))
+		if not isinstance(freq, tuple):
+			raise ValueError("this pyramid has per-band baseband columns; build it with a vco_table to query RF frequencies")
+		(band, baseband) = freq
+		if band not in bands:
+			raise ValueError("band %d is not in the pyramid (bands %s)" % (band, bands))
+		position = bands.index(band)
+		bin = int(np.clip(np.floor(baseband*nfft/float(self.meta['samp'])+0.5)+nfft//2, 0, nfft-1))
+		return position*nfft+bin
+
+	def freq_axis(self, columns):
+		"""Frequency of level 0 columns: RF (Hz) on an RF grid, otherwise baseband (Hz) within the band."""
+		nfft = self.meta['nfft']
+		columns = np.asarray(columns)
+		if self.meta.get('axis') == 'rf':
+			return self.meta['f_min']+columns*self.meta['df']
+		return (columns % nfft-nfft//2)*self.meta['samp']/float(nfft)
+
+	def query(self, t0, t1, f0, f1, rows, cols, how='max'):
+		period = self.meta['sweep_period']
+		(s0, s1) = (max(int(t0/period), 0), max(int(np.ceil(t1/period)), 1))
+		(f0, f1) = (self.column(f0), self.column(f1)+1)
+		if f1 <= f0:
+			(f0, f1) = (f1-1, f0+1)
+		k = 0
+		while k+1 < len(self.levels) and (s1-s0)//2**(k+1) >= rows and (f1-f0)//2**(k+1) >= cols:
+			k = k+1
+		psd = self.levels[k][how][s0 >> k:-(-s1 >> k), f0 >> k:-(-f1 >> k)]
+		time_axis = (np.arange(psd.shape[0])+(s0 >> k))*(2**k)*period
+		freq_axis = self.freq_axis((np.arange(psd.shape[1])+(f0 >> k))*2**k)
+		return (np.array(psd), k, time_axis, freq_axis)
+
+def _sweep_plan(options, band1, band2, step):
+	"""Sweep plan (band map, step and sweep layout) for one register setting."""
+	plan_opt = copy.copy(options)
+	(plan_opt.band1, plan_opt.band2, plan_opt.step) = (band1, band2, step)
+	plan_opt = step_size_metrics(plan_opt)
+	return {'band1': band1, 'band2': band2, 'step': step, 'bands': _band_list(plan_opt),
+		'sweep_time': plan_opt.sweep_time, 'num_bands': plan_opt.num_bands}
+
+class adaptive_compensator(gr.sync_block):
+	"""Compensates the sweeper stream for the current sweep plan and measures per-band activity.
+
+	request_plan() gives the device time at which the band and step registers are written
+	(see adaptive_sweep_block.write_plan). The time is turned into a sample offset with the
+	rx_time tags of the USRP, so the switch does not depend on how late the samples reach
+	this block. The FPGA finishes the sweep in progress, so the new plan starts on the first
+	sweep boundary of the old plan at or after that sample. settle_sweeps sweeps of the new
+	plan are zeroed, and the first compensated sweep after them is tagged 'sweep_plan' with
+	the band map, step and sweep_time.
+
+	Activity of a band in a sweep is the fraction of its sub-blocks whose power is more
+	than threshold dB over the noise floor of that band. The floor is tracked across sweeps
+	(and plans) with minimum statistics: it drops to the quietest sub-block of a sweep at
+	once and rises by at most floor_rise dB per sweep, so a signal that fills a band does
+	not become its floor. floor gives a calibrated floor per band ({band: power}) instead.
+	"""
+
+	def __init__(self,plan,cal,threshold=10.0,settle_sweeps=1,num_sub=16,samp=None,floor=None,floor_rise=0.05):
+		gr.sync_block.__init__(self, name="adaptive_compensator", in_sig=[np.complex64], out_sig=[np.complex64])
+		self.lock = threading.Lock()
+		self.threshold = 10**(threshold/10.0)
+		self.settle_sweeps = settle_sweeps
+		self.num_sub = num_sub
+		self.samp = samp
+		self.floor = dict(floor) if floor is not None else {}
+		self.fixed_floor = floor is not None
+		self.floor_rise = 10**(floor_rise/10.0)
+		self._set_plan(plan, cal)
+		self.pending = None
+		self.next_plan = None
+		self.settle_start = None
+		self.switch_at = None
+		self.time_ref = None
+		self.changes = []
+		self.late = 0
+		self.activity = {}
+		self.counts = {}
+
+	def _set_plan(self, plan, cal):
+		self.plan = plan
+		self.table = cal
+		self.frame = np.zeros(len(cal), dtype=np.complex64)
+		self.phase = 0
+
+	def request_plan(self, plan, cal, at_time=None):
+		"""Switches to plan. cal is its table from load_cal_table().
+
+		at_time is the device time (s) of the timed register write. Without it, the registers
+		are taken to change at the first sample this block sees after the request.
+		"""
+		with self.lock:
+			self.pending = (plan, cal, at_time)
+
+	def read_activity(self):
+		"""Returns and clears {band: (summed activity, sweeps measured)} since the last call."""
+		with self.lock:
+			result = dict((b, (self.activity[b], self.counts[b])) for b in self.activity)
+			self.activity = {}
+			self.counts = {}
+		return result
+
+	def _measure(self):
+		sub = self.plan['sweep_time']//self.num_sub
+		x = self.frame.reshape(self.plan['num_bands'], self.plan['sweep_time'])[:, :sub*self.num_sub]
+		power = np.mean(np.abs(x.reshape(self.plan['num_bands'], self.num_sub, sub))**2, axis=2)
+		quietest = power.min(axis=1)
+		if not self.fixed_floor:
+			for (b, q) in zip(self.plan['bands'], quietest):
+				self.floor[b] = q if b not in self.floor else min(q, self.floor[b]*self.floor_rise)
+		floor = np.array([self.floor.get(b, q) for (b, q) in zip(self.plan['bands'], quietest)])
+		busy = np.mean(power > self.threshold*floor[:, None], axis=1)
+		with self.lock:
+			for (b, a) in zip(self.plan['bands'], busy):
+				self.activity[b] = self.activity.get(b, 0.0)+a
+				self.counts[b] = self.counts.get(b, 0)+1
+
+	def _schedule(self, pos):
+		(plan, cal, at_time) = self.pending
+		self.pending = None
+		write = pos
+		if at_time is not None and self.time_ref is not None:
+			write = self.time_ref[0]+int(round((at_time-self.time_ref[1])*self.samp))
+			if write < pos:
+				# the write took effect before these samples arrived; switch as soon as possible
+				self.late = self.late+1
+				stderr.write("Warning: sweep plan change at sample %d reached the compensator at sample %d\n" % (write, pos))
+				write = pos
+		start = pos-self.phase
+		period = len(self.table)
+		self.next_plan = (plan, cal)
+		self.settle_start = start+(write-start+period-1)//period*period
+		self.switch_at = self.settle_start+self.settle_sweeps*len(cal)
+
+	def _switch(self, offset):
+		self._set_plan(self.next_plan[0], self.next_plan[1])
+		self.next_plan = None
+		self.settle_start = None
+		self.switch_at = None
+		info = dict((k, self.plan[k]) for k in ['band1', 'band2', 'step', 'sweep_time'])
+		self.add_item_tag(0, offset, pmt.intern("sweep_plan"), pmt.to_pmt(info))
+		self.changes.append((offset, info))
+
+	def work(self, input_items, output_items):
+		x = input_items[0]
+		out = output_items[0]
+		base = self.nitems_read(0)
+		for tag in self.get_tags_in_window(0, 0, len(x), pmt.intern("rx_time")):
+			secs = pmt.to_uint64(pmt.tuple_ref(tag.value, 0))+pmt.to_double(pmt.tuple_ref(tag.value, 1))
+			self.time_ref = (tag.offset, secs)
+		i = 0
+		while i < len(x):
+			pos = base+i
+			if self.next_plan is None:
+				with self.lock:
+					if self.pending is not None:
+						self._schedule(pos)
+			if self.switch_at is not None and pos >= self.switch_at:
+				self._switch(pos)
+			if self.settle_start is not None and pos >= self.settle_start:
+				# settling sweeps of the new plan
+				n = min(len(x)-i, self.switch_at-pos)
+				out[i:i+n] = 0
+				i = i+n
+				continue
+			n = min(len(x)-i, len(self.table)-self.phase)
+			if self.settle_start is not None:
+				n = min(n, self.settle_start-pos)
+			out[i:i+n] = x[i:i+n]*self.table[self.phase:self.phase+n]
+			self.frame[self.phase:self.phase+n] = out[i:i+n]
+			self.phase = self.phase+n
+			i = i+n
+			if self.phase == len(self.table):
+				self._measure()
+				self.phase = 0
+		return len(x)
+
+class adaptive_sweep_block(gr.top_block):
+
+	def __init__(self,options,plan,cal):
+		gr.top_block.__init__(self, "Top Block")
+
+		##################################################
+		# Blocks
+		##################################################
+		self.usrp_source = uhd.usrp_source(
+		",".join((options.dev_args, recv_tuning_args(options))),
+		uhd.stream_args(
+		cpu_format="fc32",
+		channels=range(1),
+		),
+		)
+
+		# Initialization code for controlling the DAC output
+		self.iface = self.usrp_source.get_dboard_iface(0)
+		self.iface.write_aux_dac(uhd.dboard_iface.UNIT_TX, uhd.dboard_iface.AUX_DAC_A, 0.2)
+
+		# Chirp enable, clock divider, ramp limits and RF divider stay fixed
+		self.usrp_source.set_user_register(3,1,0)
+		self.usrp_source.set_user_register(5,4,0)
+		self.usrp_source.set_user_register(7,621,0)
+		self.usrp_source.set_user_register(8,3103,0)
+		self.usrp_source.set_user_register(6,options.rf_div,0)
+		self.write_plan(plan)
+
+		self.usrp_source.set_gain(options.rgain, 0)
+		self.usrp_source.set_antenna(options.rx_ant, 0)
+		self.usrp_source.set_bandwidth(options.samp, 0)
+		self.usrp_source.set_samp_rate(options.samp)
+
+		self.dc_blocker_xx_0 = filter.dc_blocker_cc(256, False)
+		self.adaptive_compensator_0 = adaptive_compensator(plan, cal, getattr(options, 'threshold', 10.0),
+			getattr(options, 'settle_sweeps', 1), samp=options.samp, floor=getattr(options, 'noise_floor', None),
+			floor_rise=getattr(options, 'floor_rise', 0.05))
+		self.blocks_skiphead_0 = blocks.skiphead(gr.sizeof_gr_complex*1, options.skip)
+		self.blocks_head_1 = blocks.head(gr.sizeof_gr_complex*1,options.maxsamp)
+		self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1,options.filename[0],False)
+		self.blocks_file_sink_0.set_unbuffered(False)
+
+		##################################################
+		# Connections
+		##################################################
+		self.connect((self.usrp_source,0),(self.dc_blocker_xx_0,0))
+		self.connect((self.dc_blocker_xx_0,0),(self.adaptive_compensator_0,0))
+		self.connect((self.adaptive_compensator_0,0),(self.blocks_skiphead_0,0))
+		self.connect((self.blocks_skiphead_0,0),(self.blocks_head_1,0))
+		self.connect((self.blocks_head_1,0),(self.blocks_file_sink_0,0))
+
+		if getattr(options, 'tune', False):
+			tune_flowgraph(self, options)
+
+	def write_plan(self, plan, at_time=None):
+		# register 1/2 = band bitmaps, register 4 = jump value
+		# With at_time (device seconds) the writes are timed commands executed at that time
+		if at_time is not None:
+			self.usrp_source.set_command_time(uhd.time_spec(at_time), 0)
+		self.usrp_source.set_user_register(1,plan['band1'],0)
+		self.usrp_source.set_user_register(2,plan['band2'],0)
+		self.usrp_source.set_user_register(4,plan['step'],0)
+		if at_time is not None:
+			self.usrp_source.clear_command_time(0)
+			if self.usrp_source.get_time_now().get_real_secs() > at_time:
+				stderr.write("Warning: sweep plan registers for %.6f were sent late\n" % at_time)
+
+	def device_time(self):
+		return self.usrp_source.get_time_now().get_real_secs()
+
+def adaptive_sweep(options,top_block_cls = adaptive_sweep_block):
+	"""Wrapper function for SweepSense capture with an activity driven sweep plan.
+
+	Inputs:
+		1. options (object)
+		2. top_block_cls (default is adaptive_sweep_block)
+	Outputs:
+		List of (sample offset, plan) for every plan change, offsets relative to the saved capture
+
+	Runs a compensated standalone capture (like mode 3) and rewrites the band (1, 2) and
+	step (4) registers while it runs. Every adapt_interval seconds the per-band activity of
+	the compensated stream is folded into a running average, and the cached calibration
+	with the most activity per sample of sweep time is chosen; busy bands get revisited more
+	often, with a finer step or fewer bands. Every adapt_full_every decisions the plan that
+	covers the most bands is used instead, so quiet bands are still scanned.
+
+	Each change is a timed register write adapt_lead seconds ahead of the device clock. The
+	compensator locates that instant in the stream from the rx_time tags, zeroes settle_sweeps
+	sweeps of the new plan and tags the first compensated one with 'sweep_plan'. This assumes
+	the FPGA starts the new ramp on the first sweep boundary after the write.
+
+	Attributes of options (in addition to the ones used by sweep() in mode 3):
+		1. cal_cache: Calibrations available to the scheduler. (dict)
+			{(band1, band2, step): <path_to_calibration_data>}
+			The entry matching band1, band2 and step of options is used first.
+
+		2. adapt_interval: Seconds between scheduling decisions. (float, default 0.5)
+
+		3. adapt_full_every: Number of decisions between full range scans. (int, default 10)
+
+		4. adapt_memory: Weight of past activity in the running average. (float, default 0.7)
+
+		5. threshold: Activity threshold in dB over the noise floor of a band. (float, default 10)
+			The floor is tracked per band (see adaptive_compensator); floor_rise (dB per sweep,
+			default 0.05) limits how fast it rises, and noise_floor ({band: power}) fixes it.
+
+		6. filename: [<path_to_sweepsense_rx_samples>] (list)
+
+		7. adapt_lead: Seconds between issuing a plan change and its register write on the
+			device clock. Must cover the control path latency. (float, default 0.05)
+
+		8. settle_sweeps: Sweeps of the new plan zeroed after a change. (int, default 1)
+	"""
+	plans = []
+	cals = {}
+	for key in sorted(options.cal_cache.keys()):
+		plan = _sweep_plan(options, key[0], key[1], key[2])
+		plans.append(plan)
+		cals[key] = load_cal_table(options.cal_cache[key], Values(plan))
+	current = [p for p in plans if (p['band1'], p['band2'], p['step']) == (options.band1, options.band2, options.step)]
+	if len(current) == 0:
+		print("No calibration in cal_cache for band1="+str(options.band1)+", band2="+str(options.band2)+", step="+str(options.step)+". Exiting")
+		exit(-1)
+	current = current[0]
+	full = max(plans, key=lambda p: (len(p['bands']), -p['sweep_time']))
+	memory = getattr(options, 'adapt_memory', 0.7)
+	activity = dict((b, 1.0) for p in plans for b in p['bands'])
+
+	tb = top_block_cls(options, current, cals[(current['band1'], current['band2'], current['step'])])
+	start_time = time.time()
+	print("Start Time: " + str(start_time))
+	tb.start()
+	runner = threading.Thread(target=tb.wait)
+	runner.start()
+	decision = 0
+	while runner.is_alive():
+		runner.join(getattr(options, 'adapt_interval', 0.5))
+		if not runner.is_alive():
+			break
+		for (b, (total, count)) in tb.adaptive_compensator_0.read_activity().items():
+			activity[b] = memory*activity[b]+(1-memory)*total/count
+		decision = decision+1
+		if decision % getattr(options, 'adapt_full_every', 10) == 0:
+			chosen = full
+		else:
+			# detections per sample of radio time, with a floor so no band is written off
+			chosen = max(plans, key=lambda p: sum(activity[b]+0.01 for b in p['bands'])/float(p['sweep_time']*p['num_bands']))
+		if chosen is not current:
+			at_time = tb.device_time()+getattr(options, 'adapt_lead', 0.05)
+			tb.write_plan(chosen, at_time)
+			tb.adaptive_compensator_0.request_plan(chosen, cals[(chosen['band1'], chosen['band2'], chosen['step'])], at_time)
+			print("Plan: bands "+str(chosen['bands'])+", step "+str(chosen['step']))
+			current = chosen
+	end_time = time.time()
+	print("Total Elapsed: " + str(end_time - start_time) + "seconds")
+	return [(offset-options.skip, info) for (offset, info) in tb.adaptive_compensator_0.changes if offset >= options.skip]
+
+def stream_tuning(options):
+	"""Computes host streaming settings for a sweep plan.
+
+	Input: options (object)
+	Returns: dictionary with
+		recv_frame_size, num_recv_frames, recv_buff_size: UHD receive transport arguments
+		buffer_items: GNURadio output buffer size (items) for every block in the flowgraph
+
+	The socket buffer holds tune_buffer_time seconds of samples on the wire (sc16) and at
+	least four whole sweeps; block buffers hold at least two sweeps (inN sweeps each when
+	sweeps are subsampled), which also lets file sinks write large blocks at a time.
+
+	Attributes of options:
+		1. samp, sweep_time, num_bands, inN: Sweep plan, see sweep().
+
+		2. tune_buffer_time: Seconds of samples the receive socket can hold. (float, default 0.25)
+
+		3. tune_frame_size: UHD receive frame size in bytes. (int, default 1472)
+	"""
+	frame_len = options.sweep_time*options.num_bands
+	frame_size = getattr(options, 'tune_frame_size', 1472)
+	wire_bytes = 4
+	recv_buff_size = max(int(options.samp*wire_bytes*getattr(options, 'tune_buffer_time', 0.25)), 4*frame_len*wire_bytes)
+	recv_buff_size = (recv_buff_size//(1 << 20)+1) << 20
+	buffer_items = 1
+	while buffer_items < max(2*frame_len*getattr(options, 'inN', 1), int(options.samp*0.02)):
+		buffer_items = buffer_items*2
+	return {'recv_frame_size': frame_size, 'num_recv_frames': -(-recv_buff_size//frame_size),
+		'recv_buff_size': recv_buff_size, 'buffer_items': buffer_items}
+
+def recv_tuning_args(options):
+	"""UHD device arguments with the receive transport settings of stream_tuning() (empty if options.tune is off)."""
+	if not getattr(options, 'tune', False):
+		return ""
+	tuning = stream_tuning(options)
+	return "recv_frame_size=%d,num_recv_frames=%d,recv_buff_size=%d" % (tuning['recv_frame_size'], tuning['num_recv_frames'], tuning['recv_buff_size'])
+
+def tune_flowgraph(tb, options):
+	"""Applies stream_tuning() to the blocks of a flowgraph, before it is started.
+
+	Every block gets the computed output buffer size. With options.tune_affinity the USRP sources, file sinks and the remaining
+	(DSP) blocks are pinned to the given cores, as {'source': [0], 'dsp': [1, 2], 'sink': [3]}.
+	options.tune_realtime requests realtime scheduling for the flowgraph threads.
+	"""
+	tuning = stream_tuning(options)
+	affinity = getattr(options, 'tune_affinity', None)
+	if getattr(options, 'tune_realtime', False):
+		if gr.enable_realtime_scheduling() != gr.RT_OK:
+			stderr.write("Warning: failed to enable realtime scheduling\n")
+	for (name, block) in sorted(vars(tb).items()):
+		if not hasattr(block, 'set_min_output_buffer') or isinstance(block, gr.top_block):
+			continue
+		if name.startswith('usrp_source'):
+			role = 'source'
+		elif name.find('sink') != -1:
+			role = 'sink'
+		else:
+			role = 'dsp'
+		block.set_min_output_buffer(tuning['buffer_items'])
+		if affinity is not None and role in affinity:
+			block.set_processor_affinity(affinity[role])
+	try:
+		rmem_max = int(open('/proc/sys/net/core/rmem_max').read())
+		if rmem_max < tuning['recv_buff_size']:
+			stderr.write("Warning: net.core.rmem_max (%d) is below recv_buff_size (%d)\n" % (rmem_max, tuning['recv_buff_size']))
+	except (IOError, ValueError):
+		pass
+
+class overflow_counter(gr.sync_block):
+	"""Counts receive overflows. The USRP source re-tags rx_time after every overflow."""
+
+	def __init__(self):
+		gr.sync_block.__init__(self, name="overflow_counter", in_sig=[np.complex64], out_sig=None)
+		self.rx_time_tags = 0
+
+	def overflows(self):
+		return max(self.rx_time_tags-1, 0)
+
+	def work(self, input_items, output_items):
+		self.rx_time_tags = self.rx_time_tags+len(self.get_tags_in_window(0, 0, len(input_items[0]), pmt.intern("rx_time")))
+		return len(input_items[0])
+
+class tune_test_block(gr.top_block):
+
+	def __init__(self,options):
+		gr.top_block.__init__(self, "Top Block")
+
+		##################################################
+		# Blocks
+		##################################################
+		self.usrp_source = uhd.usrp_source(
+		",".join((options.dev_args, recv_tuning_args(options))),
+		uhd.stream_args(
+		cpu_format="fc32",
+		channels=range(1),
+		),
+		)
+		self.usrp_source.set_samp_rate(options.samp)
+		self.usrp_source.set_bandwidth(options.samp, 0)
+		self.blocks_head_0 = blocks.head(gr.sizeof_gr_complex*1, int(options.samp*getattr(options, 'tune_test_time', 5.0)))
+		# the test writes next to the capture so the disk (or ramdisk) is part of the test
+		self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1, options.filename[0], False)
+		self.blocks_file_sink_0.set_unbuffered(False)
+		self.overflow_counter_0 = overflow_counter()
+
+		##################################################
+		# Connections
+		##################################################
+		self.connect((self.usrp_source, 0), (self.blocks_head_0, 0))
+		self.connect((self.blocks_head_0, 0), (self.blocks_file_sink_0, 0))
+		self.connect((self.blocks_head_0, 0), (self.overflow_counter_0, 0))
+
+		tune_flowgraph(self, options)
+
+def stream_selftest(options,top_block_cls = tune_test_block):
+	"""Checks that the host can stream with the tuned settings without overflows.
+
+	Inputs:
+		1. options (object)
+		2. top_block_cls (default is tune_test_block)
+	Outputs:
+		Dictionary with the settings of stream_tuning() and a 'trials' list of
+		(sample rate, overflows, achieved rate), plus 'rate', the highest overflow-free rate.
+
+	Streams tune_test_time seconds to a temporary file in the folder of options.filename[0]
+	(the capture itself is not touched) at options.samp. If overflows are
+	seen, lower rates supported by the N210 (100 MSps / n) are tried until one streams
+	cleanly. The sweep plan itself is not checked, only the host streaming path.
+	Prints a short report of the chosen settings and results.
+	"""
+	test_opt = copy.copy(options)
+	test_opt.tune = True
+	(handle, test_file) = tempfile.mkstemp(suffix='.tune', dir=os.path.dirname(os.path.abspath(options.filename[0])))
+	os.close(handle)
+	test_opt.filename = [test_file]+list(options.filename[1:])
+	tuning = stream_tuning(test_opt)
+	rates = [options.samp]+[100e6/n for n in range(int(np.ceil(100e6/options.samp))+1, 21)]
+	tuning['trials'] = []
+	tuning['rate'] = 0
+	try:
+		for rate in rates:
+			test_opt.samp = rate
+			tb = top_block_cls(test_opt)
+			start_time = time.time()
+			tb.start()
+			tb.wait()
+			elapsed = time.time()-start_time
+			overflows = tb.overflow_counter_0.overflows()
+			tuning['trials'].append((rate, overflows, tb.blocks_head_0.nitems_written(0)/elapsed))
+			del tb
+			if overflows == 0:
+				tuning['rate'] = rate
+				break
+	finally:
+		os.remove(test_file)
+
+	print("Stream tuning report")
+	for key in ['recv_frame_size', 'num_recv_frames', 'recv_buff_size', 'buffer_items']:
+		print("  "+key+": "+str(tuning[key]))
+	print("  affinity: "+str(getattr(options, 'tune_affinity', None))+", realtime: "+str(getattr(options, 'tune_realtime', False)))
+	for (rate, overflows, achieved) in tuning['trials']:
+		print("  "+str(rate/1e6)+" MSps: "+str(overflows)+" overflows, "+str(achieved/1e6)+" MSps achieved")
+	print("Overflow-free rate: "+str(tuning['rate']/1e6)+" MSps")
+	return tuning
+
+# Increment when the layout of the VCO lookup table changes
+VCO_TABLE_VERSION = 1
+
+def characterize_vco(options,capture=True,top_block_cls = cal_block):
+	"""Measures the LO frequency of every sample in a sweep and saves it as a lookup table.
+
+	Inputs:
+		1. options (object)
+		2. capture (bool): capture the calibration tones first. If False, the files listed in
+		   '<freq_list>_op.txt' by an earlier calibrate() or capture_tones() run are used.
+		3. top_block_cls (default is cal_block)
+	Outputs:
+		Path of the saved table ('vco_step_<step>_rfdiv_<rf_div>.npz' in options.filename[1])
+
+	Every calibration tone shows up at baseband as tone - LO while the VCO sweeps past it.
+	The instantaneous frequency of the captured tone, averaged over all captured sweeps,
+	gives the LO trajectory wherever that tone is strong. The strongest tone is used at each
+	sample, and a polynomial in the sample index is fitted to each band so that gaps between
+	tones are filled in. Use load_vco_table() and sample_rf() to read the result.
+
+	Attributes of options (in addition to the ones used by calibrate()):
+		1. vco_fit_order: Order of the polynomial fitted to each band. (int, default 3)
+
+		2. threshold: Tone detection threshold in dB above the median power. (float, default 10)
+	"""
+	if capture:
+		tones = capture_tones(options,top_block_cls)
+	else:
+		freqs = [int(f) for f in open(options.filename[0],"r").readlines() if f.strip() != '']
+		files = [f.strip() for f in open(options.filename[0][0:-4]+'_op.txt',"r").readlines() if f.strip() != '']
+		tones = list(zip(freqs, files))
+
+	frame_len = options.sweep_time*options.num_bands
+	threshold = 10**(getattr(options, 'threshold', 10.0)/10.0)
+	smooth = np.ones(16, dtype=np.float32)/16
+	best_power = np.zeros(frame_len)
+	lo = np.full(frame_len, np.nan)
+	for (freq, filename) in tones:
+		source = _capture_frames(filename, frame_len)
+		frames = np.asarray(source[0:len(source)])
+		_close_frames(source)
+		if len(frames) == 0:
+			print("No whole sweeps in "+filename+", skipping")
+			continue
+		# average over sweeps: the LO trajectory repeats every sweep
+		diff = np.zeros(frame_len, dtype=np.complex64)
+		diff[:-1] = np.mean(frames[:, 1:]*np.conj(frames[:, :-1]), axis=0)
+		power = np.convolve(np.mean(np.abs(frames)**2, axis=0), smooth, mode='same')
+		inst = np.angle(np.convolve(diff, smooth, mode='same'))*options.samp/(2*np.pi)
+		valid = (power > threshold*np.median(power)) & (np.abs(inst) < 0.4*options.samp) & (power > best_power)
+		lo[valid] = freq-inst[valid]
+		best_power[valid] = power[valid]
+
+	order = getattr(options, 'vco_fit_order', 3)
+	bands = _band_list(options)
+	base = np.zeros(len(bands))
+	offset = np.zeros(frame_len, dtype=np.float32)
+	coef = np.full((len(bands), order+1), np.nan)
+	t = np.arange(options.sweep_time)/float(options.sweep_time)
+	for b in range(len(bands)):
+		seg = lo[b*options.sweep_time:(b+1)*options.sweep_time]
+		ok = ~np.isnan(seg)
+		if np.count_nonzero(ok) < 4*(order+1):
+			print("Warning: band "+str(bands[b])+" is not covered by the calibration tones")
+			offset[b*options.sweep_time:(b+1)*options.sweep_time] = np.nan
+			continue
+		coef[b] = np.polyfit(t[ok], seg[ok], order)
+		fit = np.polyval(coef[b], t)
+		base[b] = np.mean(fit)
+		offset[b*options.sweep_time:(b+1)*options.sweep_time] = fit-base[b]
+		print("Band "+str(bands[b])+": "+str(fit[0]/1e6)+" MHz to "+str(fit[-1]/1e6)+" MHz")
+
+	path = options.filename[1]+'vco_step_'+str(options.step)+'_rfdiv_'+str(options.rf_div)+'.npz'
+	np.savez(path, version=VCO_TABLE_VERSION, step=options.step, rf_div=options.rf_div, band1=options.band1,
+		band2=options.band2, samp=options.samp, sweep_time=options.sweep_time, bands=np.array(bands),
+		base=base, offset=offset, coef=coef)
+	print("Saved VCO table to: "+path)
+	return path
+
+def load_vco_table(path,options=None):
+	"""Loads a VCO lookup table saved by characterize_vco().
+
+	Inputs:
+		1. path (string)
+		2. options (object, optional): if given, the table must match its band1, band2, step and rf_div
+	Returns:
+		Dictionary of the saved fields, plus 'lo': LO frequency (Hz, float64) of every sample of a sweep
+	"""
+	data = np.load(path)
+	if int(data['version']) != VCO_TABLE_VERSION:
+		stderr.write("Error: VCO table %s has version %d, expected %d\n" % (path, int(data['version']), VCO_TABLE_VERSION))
+		exit(1)
+	table = dict((k, data[k]) for k in data.files)
+	if options is not None:
+		for key in ['band1', 'band2', 'step', 'rf_div']:
+			if int(table[key]) != getattr(options, key):
+				stderr.write("Error: VCO table %s was measured for %s=%d, not %d\n" % (path, key, int(table[key]), getattr(options, key)))
+				exit(1)
+	table['lo'] = np.repeat(table['base'], int(table['sweep_time']))+table['offset']
+	return table
+
+def sample_rf(table, n, baseband=0.0):
+	"""RF frequency (Hz) seen at baseband frequency 'baseband' by sample(s) n of a sweep-aligned capture.
+
+	n may be an array of sample indices; indices past the first sweep wrap around.
+	"""
+	return table['lo'][np.asarray(n) % len(table['lo'])]+baseband
+
+class timed_cal_block(gr.top_block):
+
+	def __init__(self,options,filename):
+		gr.top_block.__init__(self, "Top Block")
+
+		##################################################
+		# Blocks
+		##################################################
+		# addr0 is the sweeper, addr1 the OTS USRP sending the tones (MIMO cable)
+		self.usrp_source = uhd.usrp_source(
+		",".join(("addr0=192.168.10.2,addr1=192.168.20.3", recv_tuning_args(options))),
+		uhd.stream_args(
+		cpu_format="fc32",
+		channels=range(2),
+		),
+		)
+		self.usrp_sink = uhd.usrp_sink(
+			",".join(("addr0=192.168.10.2,addr1=192.168.20.3", "")),
+			uhd.stream_args(
+				cpu_format="fc32",
+				channels=range(2),
+				),
+			)
+
+		# Initialization code for controlling the DAC output
+		self.iface = self.usrp_source.get_dboard_iface(0)
+		self.iface.write_aux_dac(uhd.dboard_iface.UNIT_TX, uhd.dboard_iface.AUX_DAC_A, 0.2)
+
+		# Sweeper registers, as in cal_block
+		self.usrp_source.set_user_register(3,1,0)
+		self.usrp_source.set_user_register(1,options.band1,0)
+		self.usrp_source.set_user_register(2,options.band2,0)
+		self.usrp_source.set_user_register(5,4,0)
+		self.usrp_source.set_user_register(4,options.step,0)
+		self.usrp_source.set_user_register(7,621,0)
+		self.usrp_source.set_user_register(8,3103,0)
+		self.usrp_source.set_user_register(6,options.rf_div,0)
+
+		# Setting params for sweeper
+		self.usrp_source.set_samp_rate(options.samp)
+		self.usrp_source.set_gain(options.rgain, 0)
+		self.usrp_source.set_antenna("RX2", 0)
+		self.usrp_source.set_bandwidth(options.samp, 0)
+		self.usrp_source.set_clock_source("mimo", 1)
+		self.usrp_source.set_time_source("mimo", 1)
+
+		# Sweeper TX parked off band, OTS TX starts on the first tone
+		self.usrp_sink.set_samp_rate(options.txsamp)
+		self.usrp_sink.set_gain(options.tgain,0)
+		self.usrp_sink.set_antenna("TX/RX",0)
+		self.usrp_sink.set_center_freq(options.txfreq-100e6,0)
+		self.usrp_sink.set_gain(options.tgain,1)
+		self.usrp_sink.set_antenna("TX/RX",1)
+		self.usrp_sink.set_center_freq(options.txfreq,1)
+		self.usrp_sink.set_bandwidth(options.txsamp,1)
+		self.usrp_sink.set_clock_source("mimo",1)
+		self.usrp_sink.set_time_source("mimo",1)
+
+		# Both radios share the sweeper's clock; reception starts at a known time
+		self.usrp_source.set_time_now(uhd.time_spec(0.0), uhd.ALL_MBOARDS)
+		self.start_time = getattr(options, 'hop_start', 1.0)
+		self.usrp_source.set_start_time(uhd.time_spec(self.start_time))
+
+		self.analog_sig_source_x_0 = analog.sig_source_c(options.txsamp, analog.GR_CONST_WAVE, 0, 0, 1)
+		self.null_source_0 = blocks.null_source(gr.sizeof_gr_complex*1)
+		self.null_sink_0 = blocks.null_sink(gr.sizeof_gr_complex*1)
+
+		self.blocks_head_0 = blocks.head(gr.sizeof_gr_complex*1, options.total_samp)
+		# File meta sink, so the rx_time of every segment (and of any overflow) is kept
+		pmt_a = pmt.make_dict()
+		self.blocks_file_sink_0 = blocks.file_meta_sink(gr.sizeof_gr_complex*1, filename[0], options.samp, 1, blocks.GR_FILE_FLOAT, True, options.sweep_time*options.num_bands, pmt_a, True)
+		self.blocks_file_sink_0.set_unbuffered(False)
+
+		##################################################
+		# Connections
+		##################################################
+		self.connect((self.usrp_source, 0), (self.blocks_head_0, 0))
+		self.connect((self.blocks_head_0, 0), (self.blocks_file_sink_0, 0))
+		self.connect((self.usrp_source, 1), (self.null_sink_0, 0))
+		self.connect((self.null_source_0, 0), (self.usrp_sink, 0))
+		self.connect((self.analog_sig_source_x_0, 0), (self.usrp_sink, 1))
+
+	def tune_tone_at(self, freq, when):
+		# timed command on the OTS motherboard, executed at device time 'when'
+		# Returns False if the command was not sent before that time
+		self.usrp_sink.set_command_time(uhd.time_spec(when), 1)
+		self.usrp_sink.set_center_freq(freq, 1)
+		self.usrp_sink.clear_command_time(1)
+		return self.device_time() < when
+
+	def device_time(self):
+		return self.usrp_source.get_time_now(0).get_real_secs()
+
+def calibrate_timed(options,top_block_cls = timed_cal_block):
+	"""Two radio calibration without operator input, using timed tone hops.
+
+	Inputs:
+		1. options (object)
+		2. top_block_cls (default is timed_cal_block)
+	Outputs:
+		None
+
+	Replaces the interactive mode 2 calibration. Both USRPs stream for the whole run while
+	the OTS transmitter hops through the tone list with timed tune commands. Tone k is
+	tuned at hop_start + k*dwell seconds of device time, where each dwell is hop_settle +
+	maxsamp/(sweep_time*num_bands) whole sweeps. Commands are queued hop_lead seconds ahead
+	of time. The single received stream is then cut at the tune times: the first hop_settle
+	sweeps after each hop are dropped and the next maxsamp samples are saved as that tone's
+	calibration file, named like the files of calibrate(). The files are combined with
+	combine_cal() into '<save_path>combined_rt_cal.dat'.
+
+	The stream is saved with its file_meta_sink headers, and the tune times are mapped to
+	file offsets with the rx_time of each segment. The calibration is aborted if a receive
+	overflow falls inside a tone's samples, or if a tune command was sent after its hop time.
+
+	Attributes of options (in addition to the ones used by calibrate()):
+		1. hop_settle: Sweeps dropped after every hop while the transmitter settles. (int, default 1)
+
+		2. hop_lead: Seconds ahead of a hop at which its timed command is sent. (float, default 0.1)
+
+		3. hop_start: Device time (s) at which reception and the first tone start. (float, default 1.0)
+	"""
+	frame_len = options.sweep_time*options.num_bands
+	settle = getattr(options, 'hop_settle', 1)
+	lead = getattr(options, 'hop_lead', 0.1)
+	cal_tone_list = open(options.filename[0],"r")
+	freqs = [int(f) for f in cal_tone_list.readlines() if f.strip() != '']
+	cal_tone_list.close()
+
+	dwell_samp = settle*frame_len+options.maxsamp
+	options.total_samp = dwell_samp*len(freqs)
+	options.txfreq = freqs[0]
+	raw_file = options.filename[1]+'timed_cal_raw.dat'
+	tb = top_block_cls(options,[raw_file])
+	hop_times = [tb.start_time+k*dwell_samp/float(options.samp) for k in range(len(freqs))]
+
+	start_time = time.time()
+	print("Start Time: " + str(start_time))
+	tb.start()
+	late = []
+	for k in range(1, len(freqs)):
+		while tb.device_time() < hop_times[k]-lead:
+			time.sleep(lead/10.0)
+		if not tb.tune_tone_at(freqs[k], hop_times[k]):
+			late.append(freqs[k])
+		print("Tone at " + str(freqs[k]) + " Hz scheduled for t=" + str(hop_times[k]))
+	tb.wait()
+	end_time = time.time()
+	print("Total Elapsed: " + str(end_time - start_time) + "seconds")
+	if len(late) > 0:
+		stderr.write("Error: tune commands for %s Hz were sent after their hop time; increase hop_lead\n" % late)
+		exit(1)
+
+	# file offset and rx_time of every contiguous stretch of the stream
+	segments = []
+	offset = 0
+	for info in read_meta_headers(raw_file):
+		t = info["rx_time"]
+		if len(segments) > 0 and abs(segments[-1][1]+(offset-segments[-1][0])/float(options.samp)-t)*options.samp < 0.5:
+			offset = offset+info["nitems"]
+			continue
+		segments.append((offset, t))
+		offset = offset+info["nitems"]
+	segments.append((offset, None))
+
+	# cut the stream at the tune times into one file per tone
+	raw = np.memmap(raw_file, dtype=np.complex64, mode='r')
+	cal_tone_save = open(options.filename[0][0:-4]+'_op.txt',"w+")
+	for (k, freq) in enumerate(freqs):
+		when = hop_times[k]+settle*frame_len/float(options.samp)
+		s = max([j for j in range(len(segments)-1) if segments[j][1] <= when+0.5/options.samp] or [0])
+		first = segments[s][0]+int(round((when-segments[s][1])*options.samp))
+		if first < segments[s][0] or first+options.maxsamp > segments[s+1][0]:
+			stderr.write("Error: receive overflow during the tone at %d Hz; calibration aborted\n" % freq)
+			exit(1)
+		tone_file = options.filename[1] + str(freq) + '_step_'+ str(options.step) + '_sweeped_tone.dat'
+		np.asarray(raw[first:first+options.maxsamp]).tofile(tone_file)
+		cal_tone_save.write(tone_file+'\n')
+	cal_tone_save.close()
+	del raw
+	os.remove(raw_file)
+	os.remove(raw_file+'.hdr')
+	print("Calibration capture complete")
+	combine_cal(options,[options.filename[0][0:-4]+'_op.txt', options.filename[1]+'combined_rt_cal.dat'])
+
+def compensated_rf(table, tones):
+	"""Reference RF frequency of every sample of a sweep in the compensated (unswept) stream.
+
+	Inputs: table from load_vco_table(), tones (list of calibration tone frequencies)
+	Returns: float64 array, one entry per sample of a sweep
+
+	Unsweeping with a combined calibration leaves each sample referenced to the calibration
+	tone closest to the LO at that time: a signal at RF f appears at baseband f - ref[n].
+	"""
+	tones = np.sort(np.asarray(tones, dtype=np.float64))
+	k = np.clip(np.searchsorted(tones, table['lo']), 1, len(tones)-1)
+	lower = np.abs(table['lo']-tones[k-1]) <= np.abs(tones[k]-table['lo'])
+	return np.where(lower, tones[k-1], tones[k])
+
+class rf_grid(object):
+	"""Maps the FFT segments of a sweep onto a fixed RF grid, one bin per samp/nfft.
+
+	Inputs: options (samp, sweep_time, num_bands), table from load_vco_table(), tones (None
+	for uncompensated samples), nfft, usable (fraction of the baseband that is kept)
+
+	Each segment of nfft samples lands at the RF frequencies the VCO table gives for it
+	(referenced to compensated_rf() when tones are given). Grid bins at the ends of the sweep
+	seen by fewer than half as many segments as the best covered bin are dropped.
+	spectrum(frames) returns the mean power in every grid bin of every sweep, and freqs the
+	RF frequency (Hz) of every bin.
+	"""
+
+	def __init__(self,options,table,tones=None,nfft=256,usable=0.8):
+		self.frame_len = options.sweep_time*options.num_bands
+		self.nfft = nfft
+		usable = usable*options.samp/2
+		num_seg = self.frame_len//nfft
+		mid = np.arange(num_seg)*nfft+nfft//2
+		lo = table['lo'][mid]
+		ref = compensated_rf(table, tones)[mid] if tones is not None else lo
+		baseband = np.fft.fftshift(np.fft.fftfreq(nfft, 1.0/options.samp))
+		rf = ref[:, None]+baseband[None, :]
+		keep = np.abs(rf-lo[:, None]) < usable
+		self.df = options.samp/float(nfft)
+		grid = np.rint((rf-np.min(rf[keep]))/self.df).astype(np.int64)
+		# the ends of the sweep are seen by too few segments for a stable estimate
+		count = np.bincount(grid[keep])
+		covered = np.nonzero(count >= count.max()/2)[0]
+		keep = keep & (grid >= covered[0]) & (grid <= covered[-1])
+		self.f_min = float(np.min(rf[keep]))
+		grid = np.rint((rf-self.f_min)/self.df).astype(np.int64)
+		self.num_grid = int(grid[keep].max())+1
+		self.freqs = self.f_min+np.arange(self.num_grid)*self.df
+		self.keep = keep
+		self.grid = grid[keep]
+		self.grid_count = np.maximum(np.bincount(self.grid, minlength=self.num_grid), 1)
+		self.window = (np.hanning(nfft)/np.sqrt(np.sum(np.hanning(nfft)**2))).astype(np.float32)
+
+	def spectrum(self, frames):
+		"""RF grid power spectrum of each sweep, shape (num_sweeps, num_grid)."""
+		num_seg = self.frame_len//self.nfft
+		x = np.asarray(frames)[:, :num_seg*self.nfft].reshape(len(frames), num_seg, self.nfft)
+		p = np.fft.fftshift(np.abs(np.fft.fft(x*self.window, axis=-1))**2, axes=-1)[:, self.keep]
+		rows = np.repeat(np.arange(len(frames))*self.num_grid, len(self.grid))
+		total = np.bincount(rows+np.tile(self.grid, len(frames)), weights=p.ravel(), minlength=len(frames)*self.num_grid)
+		return total.reshape(len(frames), self.num_grid)/self.grid_count
+
+def _polyphase_decimate(x, taps, M):
+	"""Filters and decimates the rows of x by M with a polyphase filter bank.
+
+	x has shape (rows, L) with L a multiple of M. Returns shape (rows, L/M).
+	Branch p filters every M-th sample with every M-th tap, so only kept outputs are computed.
+	"""
+	(rows, L) = x.shape
+	Lm = L//M
+	Q = -(-len(taps)//M)
+	e = np.zeros(Q*M, dtype=np.float32)
+	e[:len(taps)] = taps
+	e = e.reshape(Q, M)
+	u = x.reshape(rows, Lm, M)
+	y = np.zeros((rows, Lm), dtype=np.complex64)
+	for p in range(M):
+		# branch input u_p[m] = x[m*M - p]
+		if p == 0:
+			branch = u[:, :, 0]
+		else:
+			branch = np.zeros((rows, Lm), dtype=np.complex64)
+			branch[:, 1:] = u[:, :-1, M-p]
+		for q in range(min(Q, Lm)):
+			if e[q, p] != 0:
+				y[:, q:] += e[q, p]*branch[:, :Lm-q]
+	return y
+
+class sweep_channelizer(object):
+	"""Extracts narrow channels from sweep-aligned SweepSense samples.
+
+	Inputs:
+		1. options (object): samp, sweep_time, num_bands, chan_usable, chan_oversample
+		2. table: VCO table from load_vco_table()
+		3. channels: list of (center frequency, bandwidth) in Hz
+		4. tones: calibration tone frequencies for compensated samples, None for uncompensated ones
+
+	For every channel only the dwell segments of a sweep where the whole channel lies in the
+	usable part of the baseband (chan_usable of the sample rate) are kept. Each segment is mixed
+	down with a precomputed phasor (the sweep repeats, so it is the same for every sweep) and
+	decimated by the largest factor that keeps chan_oversample times the channel bandwidth.
+	process() returns, per channel, an array of shape (num_sweeps, samples per sweep).
+	"""
+
+	def __init__(self,options,table,channels,tones=None):
+		self.frame_len = options.sweep_time*options.num_bands
+		usable = getattr(options, 'chan_usable', 0.8)*options.samp/2
+		oversample = getattr(options, 'chan_oversample', 1.25)
+		lo = table['lo']
+		ref = compensated_rf(table, tones) if tones is not None else lo
+		self.channels = []
+		for (center, bw) in channels:
+			M = max(1, int(options.samp/(bw*oversample)))
+			taps = np.array(firdes.low_pass(1, options.samp, bw/2.0, bw*(oversample-1)/2.0+1), dtype=np.float32)
+			visible = np.abs(center-lo)+bw/2.0 < usable
+			# a run ends where visibility changes, or where compensated samples switch to
+			# another calibration tone (without tones the mixing follows the moving LO)
+			edges = np.flatnonzero(np.diff(visible.astype(np.int8)) != 0)+1
+			if tones is not None:
+				edges = np.union1d(edges, np.flatnonzero(np.diff(ref) != 0)+1)
+			bounds = np.concatenate(([0], edges, [self.frame_len]))
+			runs = []
+			idx = []
+			mix = []
+			kept = 0
+			for (a, b) in zip(bounds[:-1], bounds[1:]):
+				length = ((b-a)//M)*M
+				if not visible[a] or length < max(len(taps), 4*M):
+					continue
+				n = np.arange(a, a+length)
+				phase = -2*np.pi*np.cumsum(center-ref[n])/options.samp
+				runs.append((kept, length))
+				kept = kept+length
+				idx.append(n)
+				mix.append(np.exp(1j*phase).astype(np.complex64))
+			self.channels.append({'center': center, 'bandwidth': bw, 'decimation': M, 'taps': taps,
+				'runs': runs, 'idx': np.concatenate(idx) if idx else np.zeros(0, dtype=np.int64),
+				'mix': np.concatenate(mix) if mix else np.zeros(0, dtype=np.complex64),
+				'rate': float(options.samp)/M, 'per_sweep': int(sum(length//M for (start, length) in runs))})
+			if not runs:
+				print("Warning: channel at "+str(center/1e6)+" MHz is never fully in view")
+
+	def process(self, frames):
+		result = []
+		for chan in self.channels:
+			x = np.asarray(frames)[:, chan['idx']]*chan['mix']
+			out = [_polyphase_decimate(x[:, start:start+length], chan['taps'], chan['decimation'])
+				for (start, length) in chan['runs']]
+			result.append(np.concatenate(out, axis=1) if out else np.zeros((len(frames), 0), dtype=np.complex64))
+		return result
+
+def _channel_files(folder, channelizer):
+	"""Opens one output file per channel in folder and describes them in 'channels.json'."""
+	files = []
+	info = []
+	for chan in channelizer.channels:
+		name = os.path.join(folder, 'chan_'+str(int(chan['center']))+'.dat')
+		files.append(open(name, 'wb'))
+		info.append({'file': name, 'center': float(chan['center']), 'bandwidth': float(chan['bandwidth']),
+			'rate': float(chan['rate']), 'samples_per_sweep': int(chan['per_sweep']), 'segments_per_sweep': len(chan['runs'])})
+	meta_file = open(os.path.join(folder, 'channels.json'), 'w')
+	json.dump(info, meta_file, indent=1)
+	meta_file.close()
+	return files
+
+def _cal_tone_list(options):
+	"""Calibration tones in options.cal_tones, or None for uncompensated captures."""
+	if not getattr(options, 'cal_tones', None):
+		return None
+	return [int(f) for f in open(options.cal_tones, "r").readlines() if f.strip() != '']
+
+def _channel_setup(options):
+	table = load_vco_table(options.vco_table, options)
+	return sweep_channelizer(options, table, options.channels, _cal_tone_list(options))
+
+class channelizer_sink(gr.sync_block):
+	"""Runs a sweep_channelizer on a live sweep-aligned stream and writes one file per channel."""
+
+	def __init__(self,options):
+		gr.sync_block.__init__(self, name="channelizer_sink", in_sig=[np.complex64], out_sig=None)
+		self.channelizer = _channel_setup(options)
+		self.files = _channel_files(options.chan_dir, self.channelizer)
+		self.batch = getattr(options, 'chan_batch', 8)
+		self.frame_len = self.channelizer.frame_len
+		self.buffer = np.zeros(self.batch*self.frame_len, dtype=np.complex64)
+		self.fill = 0
+
+	def _flush(self):
+		sweeps = self.fill//self.frame_len
+		if sweeps > 0:
+			for (f, y) in zip(self.files, self.channelizer.process(self.buffer[:sweeps*self.frame_len].reshape(sweeps, self.frame_len))):
+				y.tofile(f)
+		self.fill = 0
+
+	def work(self, input_items, output_items):
+		x = input_items[0]
+		used = 0
+		while used < len(x):
+			n = min(len(x)-used, len(self.buffer)-self.fill)
+			self.buffer[self.fill:self.fill+n] = x[used:used+n]
+			self.fill = self.fill+n
+			used = used+n
+			if self.fill == len(self.buffer):
+				self._flush()
+		return len(x)
+
+	def stop(self):
+		self._flush()
+		for f in self.files:
+			f.close()
+		return True
+
+def channelize(options):
+	"""Extracts narrow channels from a saved capture.
+
+	Inputs:
+		1. options (object)
+	Outputs:
+		None
+
+	Runs a sweep_channelizer over the capture in batches of chan_batch sweeps and writes one
+	fc32 file per channel ('chan_<center>.dat') plus 'channels.json' with the rate and the
+	number of samples each sweep contributes to every channel.
+
+	Attributes of options:
+		1. filename: [<path_to_capture>, <output_folder>] (list)
+
+		2. channels: List of (center frequency, bandwidth) in Hz. (list)
+			example: 2.4 GHz WiFi channel 1 and BLE advertising channel 37
+			[(2412e6, 20e6), (2402e6, 2e6)]
+
+		3. vco_table: Path to the VCO table of this step and rf_div, see characterize_vco(). (str)
+
+		4. cal_tones: Calibration frequency list the capture was compensated with. (str)
+			Leave unset for uncompensated (mode 30) captures.
+
+		5. chan_usable: Fraction of the baseband a channel must fit in. (float, default 0.8)
+
+		6. chan_oversample: Output rate as a multiple of the channel bandwidth. (float, default 1.25)
+
+		7. chan_batch: Sweeps processed at a time. (int, default 8)
+
+		8. band1, band2, step, rf_div, samp, sweep_time, num_bands: Capture settings.
+	"""
+	channelizer = _channel_setup(options)
+	files = _channel_files(options.filename[1], channelizer)
+	frames = _capture_frames(options.filename[0], channelizer.frame_len)
+	batch = getattr(options, 'chan_batch', 8)
+	start_time = time.time()
+	for first in range(0, len(frames), batch):
+		for (f, y) in zip(files, channelizer.process(frames[first:first+batch])):
+			y.tofile(f)
+	_close_frames(frames)
+	for f in files:
+		f.close()
+	elapsed = time.time()-start_time
+	print("Channelized "+str(len(frames))+" sweeps in "+str(elapsed)+" seconds")
+	for chan in channelizer.channels:
+		print("  "+str(chan['center']/1e6)+" MHz: "+str(chan['per_sweep'])+" samples per sweep at "+str(chan['rate']/1e6)+" MSps")
+
+# Capture archive layout:
+#   header: magic, version, mantissa bits, block size, frame length, sweeps per chunk,
+#           band1, band2, rf_div, step, sample rate
+#   chunks: deflate(block exponents (int8) + mantissas (int8, or int16 above 8 bits))
+#   index:  (offset, length, sweeps) for every chunk
+#   footer: index offset, number of chunks, magic
+ARCHIVE_HEADER = struct.Struct('!4sHHIIIIIHHd')
+ARCHIVE_INDEX = struct.Struct('!QII')
+ARCHIVE_FOOTER = struct.Struct('!QI4s')
+ARCHIVE_MAGIC = b'SSZ1'
+ARCHIVE_INDEX_MAGIC = b'SSZI'
+
+def _bfp_encode(x, bits, block):
+	"""Block floating point quantization of complex64 samples followed by Huffman coding (zlib)."""
+	iq = x.view(np.float32)
+	pad = (-len(iq)) % (2*block)
+	if pad > 0:
+		iq = np.concatenate((iq, np.zeros(pad, dtype=np.float32)))
+	iq = iq.reshape(-1, 2*block)
+	peak = np.max(np.abs(iq), axis=1)
+	exp = np.ceil(np.log2(np.maximum(peak, 1e-30))).astype(np.int8)
+	full_scale = 2**(bits-1)-1
+	mant = iq*(full_scale/np.exp2(exp.astype(np.float32)))[:, None]
+	np.rint(mant, out=mant)
+	mant = mant.astype(np.int8 if bits <= 8 else np.int16)
+	# quantized noise has no repeats for LZ77 to find, Huffman alone is faster and as small
+	coder = zlib.compressobj(1, zlib.DEFLATED, 15, 9, zlib.Z_HUFFMAN_ONLY)
+	return coder.compress(exp.tobytes())+coder.compress(mant.tobytes())+coder.flush()
+
+def _bfp_decode(data, bits, block, num_samp, out):
+	"""Inverse of _bfp_encode, written into the complex64 array out (num_samp long)."""
+	raw = zlib.decompress(data)
+	num_blocks = -(-num_samp//block)
+	exp = np.frombuffer(raw, dtype=np.int8, count=num_blocks)
+	mant = np.frombuffer(raw, dtype=np.int8 if bits <= 8 else np.int16, offset=num_blocks).reshape(num_blocks, 2*block)
+	scale = np.exp2(exp.astype(np.float32))/(2**(bits-1)-1)
+	iq = (mant*scale[:, None]).ravel()[:2*num_samp]
+	out.view(np.float32)[:] = iq
+
+class archive_writer(object):
+	"""Writes sweep-aligned samples to a compressed capture archive.
+
+	Inputs:
+		1. filename (string)
+		2. options (object): sweep settings stored in the header, and
+			archive_bits: mantissa bits per I/Q value (int, default 8)
+			archive_chunk: sweeps per independently compressed chunk (int, default 4)
+			archive_block: samples sharing one exponent (int, default 64)
+			archive_threads: encoder threads (int, default 4)
+
+	write() takes any number of samples; chunks are compressed on a thread pool and written
+	in order. close() writes the chunk index.
+	"""
+
+	def __init__(self,filename,options):
+		self.frame_len = options.sweep_time*options.num_bands
+		self.bits = getattr(options, 'archive_bits', 8)
+		self.block = getattr(options, 'archive_block', 64)
+		self.chunk_sweeps = getattr(options, 'archive_chunk', 4)
+		self.handle = open(filename, 'wb')
+		self.handle.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, 1, self.bits, self.block, self.frame_len, self.chunk_sweeps,
+			options.band1, options.band2, options.rf_div, options.step, float(options.samp)))
+		self.pool = ThreadPoolExecutor(getattr(options, 'archive_threads', 4))
+		self.pending = []
+		self.index = []
+		self.buffer = np.zeros(self.chunk_sweeps*self.frame_len, dtype=np.complex64)
+		self.fill = 0
+
+	def _submit(self, num_samp):
+		chunk = self.buffer[:num_samp].copy()
+		self.pending.append((num_samp//self.frame_len, self.pool.submit(_bfp_encode, chunk, self.bits, self.block)))
+		# write finished chunks in order, and bound the number in flight
+		while self.pending and (self.pending[0][1].done() or len(self.pending) > 16):
+			(sweeps, future) = self.pending.pop(0)
+			data = future.result()
+			self.index.append((self.handle.tell(), len(data), sweeps))
+			self.handle.write(data)
+
+	def write(self, x):
+		used = 0
+		while used < len(x):
+			n = min(len(x)-used, len(self.buffer)-self.fill)
+			self.buffer[self.fill:self.fill+n] = x[used:used+n]
+			self.fill = self.fill+n
+			used = used+n
+			if self.fill == len(self.buffer):
+				self._submit(self.fill)
+				self.fill = 0
+
+	def close(self):
+		# a trailing partial sweep is dropped, like the offline readers do
+		whole = (self.fill//self.frame_len)*self.frame_len
+		if whole > 0:
+			self._submit(whole)
+		self.fill = 0
+		for (sweeps, future) in self.pending:
+			data = future.result()
+			self.index.append((self.handle.tell(), len(data), sweeps))
+			self.handle.write(data)
+		self.pending = []
+		self.pool.shutdown()
+		index_offset = self.handle.tell()
+		for entry in self.index:
+			self.handle.write(ARCHIVE_INDEX.pack(*entry))
+		self.handle.write(ARCHIVE_FOOTER.pack(index_offset, len(self.index), ARCHIVE_INDEX_MAGIC))
+		self.handle.close()
+
+class archive_reader(object):
+	"""Random access reader for capture archives written by archive_writer / archive_sink.
+
+	Input: filename (string), threads (int, default 4)
+
+	Behaves like the (num_sweeps, frame_len) array of a raw capture for len() and sweep
+	slices: reader[a:b] decodes only the chunks holding sweeps a to b, on a thread pool.
+	read_sweeps(start, count, out) decodes straight into a caller supplied complex64 array.
+	The capture settings are available in 'header'.
+	"""
+
+	def __init__(self,filename,threads=4):
+		self.handle = open(filename, 'rb')
+		fields = ARCHIVE_HEADER.unpack(self.handle.read(ARCHIVE_HEADER.size))
+		self.header = dict(zip(['magic', 'version', 'bits', 'block', 'frame_len', 'chunk_sweeps',
+			'band1', 'band2', 'rf_div', 'step', 'samp'], fields))
+		if self.header['magic'] != ARCHIVE_MAGIC:
+			stderr.write("Error: %s is not a capture archive\n" % filename)
+			exit(1)
+		self.frame_len = self.header['frame_len']
+		self.handle.seek(-ARCHIVE_FOOTER.size, 2)
+		(index_offset, num_chunks, magic) = ARCHIVE_FOOTER.unpack(self.handle.read(ARCHIVE_FOOTER.size))
+		if magic != ARCHIVE_INDEX_MAGIC:
+			stderr.write("Error: capture archive %s has no index (was it closed?)\n" % filename)
+			exit(1)
+		self.handle.seek(index_offset)
+		self.index = [ARCHIVE_INDEX.unpack(self.handle.read(ARCHIVE_INDEX.size)) for k in range(num_chunks)]
+		self.first_sweep = np.cumsum([0]+[entry[2] for entry in self.index])
+		self.lock = threading.Lock()
+		self.pool = ThreadPoolExecutor(threads)
+
+	def __len__(self):
+		return int(self.first_sweep[-1])
+
+	def _decode_chunk(self, k, start, count, out):
+		(offset, length, sweeps) = self.index[k]
+		with self.lock:
+			self.handle.seek(offset)
+			data = self.handle.read(length)
+		chunk = np.empty(sweeps*self.frame_len, dtype=np.complex64)
+		_bfp_decode(data, self.header['bits'], self.header['block'], len(chunk), chunk)
+		first = self.first_sweep[k]
+		a = max(start, first)
+		b = min(start+count, first+sweeps)
+		out[a-start:b-start] = chunk.reshape(sweeps, self.frame_len)[a-first:b-first]
+
+	def read_sweeps(self, start, count, out=None):
+		count = max(0, min(count, len(self)-start))
+		if out is None:
+			out = np.empty((count, self.frame_len), dtype=np.complex64)
+		k0 = int(np.searchsorted(self.first_sweep, start, side='right'))-1
+		k1 = int(np.searchsorted(self.first_sweep, start+count, side='left'))
+		jobs = [self.pool.submit(self._decode_chunk, k, start, count, out) for k in range(k0, k1)] if count > 0 else []
+		for job in jobs:
+			job.result()
+		return out
+
+	def __getitem__(self, item):
+		(start, stop, step) = item.indices(len(self))
+		return self.read_sweeps(start, stop-start)[::step]
+
+	def close(self):
+		self.pool.shutdown()
+		self.handle.close()
+
+class archive_source(gr.sync_block):
+	"""Source block that plays back a capture archive as fc32 samples, whole chunks at a time."""
+
+	def __init__(self,filename,repeat=False):
+		gr.sync_block.__init__(self, name="archive_source", in_sig=None, out_sig=[np.complex64])
+		self.reader = archive_reader(filename)
+		self.repeat = repeat
+		self.sweep = 0
+		self.pending = np.zeros(0, dtype=np.complex64)
+
+	def work(self, input_items, output_items):
+		out = output_items[0]
+		if len(self.pending) == 0:
+			if self.sweep >= len(self.reader):
+				if not self.repeat or len(self.reader) == 0:
+					return -1
+				self.sweep = 0
+			count = self.reader.header['chunk_sweeps']
+			self.pending = self.reader.read_sweeps(self.sweep, count).ravel()
+			self.sweep = self.sweep+count
+		n = min(len(out), len(self.pending))
+		out[:n] = self.pending[:n]
+		self.pending = self.pending[n:]
+		return n
+
+	def stop(self):
+		self.reader.close()
+		return True
+
+class archive_sink(gr.sync_block):
+	"""File sink that writes a compressed capture archive instead of raw fc32 (see archive_writer)."""
+
+	def __init__(self,options,filename):
+		gr.sync_block.__init__(self, name="archive_sink", in_sig=[np.complex64], out_sig=None)
+		self.writer = archive_writer(filename, options)
+
+	def work(self, input_items, output_items):
+		self.writer.write(input_items[0])
+		return len(input_items[0])
+
+	def stop(self):
+		self.writer.close()
+		return True
+
+BURST_CLASSES = ['wifi', 'bluetooth', 'other']
+BURST_FEATURES = ['log10 bandwidth (MHz)', 'log10 duration (ms)', 'spectral flatness', 'log2 narrow bursts nearby', 'SNR (dB/10)']
+
+def default_burst_model():
+	"""Hand-set linear model: wide and flat is WiFi, narrow and hopping is Bluetooth."""
+	return {'W': np.array([[6.0, 0.0, 3.0, 0.0, 0.0], [-6.0, -0.5, 0.0, 1.5, 0.0], [0.0, 0.0, 0.0, 0.0, 0.0]]),
+		'b': np.array([-7.0, 2.0, 0.0]), 'mean': np.zeros(len(BURST_FEATURES)), 'std': np.ones(len(BURST_FEATURES))}
+
+def train_burst_model(features, labels, path=None, iterations=500, rate=0.5):
+	"""Fits the burst classifier (multinomial logistic regression) to labeled bursts.
+
+	Inputs:
+		1. features: array (num_bursts x len(BURST_FEATURES)), as returned in the 'features' of classify_bursts()
+		2. labels: index into BURST_CLASSES for every burst
+		3. path: save the model here (npz) for options.burst_model (optional)
+	Returns: model dictionary for burst_classifier
+	"""
+	features = np.asarray(features, dtype=np.float64)
+	labels = np.asarray(labels)
+	mean = features.mean(axis=0)
+	std = np.maximum(features.std(axis=0), 1e-6)
+	x = (features-mean)/std
+	y = np.eye(len(BURST_CLASSES))[labels]
+	W = np.zeros((len(BURST_CLASSES), x.shape[1]))
+	b = np.zeros(len(BURST_CLASSES))
+	for k in range(iterations):
+		z = x.dot(W.T)+b
+		p = np.exp(z-z.max(axis=1, keepdims=True))
+		p = p/p.sum(axis=1, keepdims=True)
+		W = W-rate*(p-y).T.dot(x)/len(x)
+		b = b-rate*(p-y).mean(axis=0)
+	model = {'W': W, 'b': b, 'mean': mean, 'std': std}
+	if path is not None:
+		np.savez(path, **model)
+	return model
+
+class burst_classifier(object):
+	"""Segments bursts in sweep-aligned samples and labels them as WiFi, Bluetooth or other.
+
+	Inputs:
+		1. options (object): samp, sweep_time, num_bands, inN and the burst_ attributes of classify_bursts()
+		2. table: VCO table from load_vco_table()
+		3. tones: calibration tone frequencies for compensated samples, None for uncompensated ones
+
+	Every sweep is turned into a spectrum on a fixed RF grid (see rf_grid). Grid bins above
+	the running noise floor form detections, and detections that overlap in frequency in
+	consecutive sweeps are linked into bursts. process() takes a batch of sweeps and returns the
+	bursts that ended in it as a dictionary of arrays (start/end time, center, bandwidth,
+	features, label, confidence), classified together in one matrix product.
+	"""
+
+	def __init__(self,options,table,tones=None):
+		self.frame_len = options.sweep_time*options.num_bands
+		self.threshold = 10**(getattr(options, 'burst_threshold', 10.0)/10.0)
+		self.period = self.frame_len*getattr(options, 'inN', 1)/float(options.samp)
+		self.grid = rf_grid(options, table, tones, getattr(options, 'burst_nfft', 256), getattr(options, 'burst_usable', 0.8))
+		(self.df, self.f_min, self.num_grid) = (self.grid.df, self.grid.f_min, self.grid.num_grid)
+		self.gap = int(np.ceil(getattr(options, 'burst_gap', 0.5e6)/self.df))
+
+		model = default_burst_model()
+		if getattr(options, 'burst_model', None):
+			saved = np.load(options.burst_model)
+			model = dict((k, saved[k]) for k in saved.files)
+		self.model = model
+		self.floor = None
+		self.sweep = 0
+		self.active = []
+
+	def _window_sum(self, mask, k):
+		c = np.pad(np.cumsum(mask, axis=1), ((0, 0), (k//2+1, k//2)), mode='edge')
+		c[:, :k//2+1] = 0
+		return c[:, k:]-c[:, :-k]
+
+	def process(self, frames):
+		spec = self.grid.spectrum(frames)
+		# noise floor per grid bin follows a low percentile of each batch, and is kept within
+		# 3 dB of the typical bin so long bursts do not become the floor
+		batch_floor = np.percentile(spec, 20, axis=0)
+		batch_floor = np.minimum(batch_floor, 2*np.median(batch_floor))
+		self.floor = batch_floor if self.floor is None else 0.8*self.floor+0.2*batch_floor
+		mask = spec > self.threshold*self.floor
+		# close gaps narrower than self.gap bins, so wide bursts with dips stay one detection
+		k = 2*self.gap+1
+		mask = self._window_sum(~(self._window_sum(mask, k) > 0), k) == 0
+		edges = np.diff(np.pad(mask.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+		(s_row, g0) = np.nonzero(edges == 1)
+		g1 = np.nonzero(edges == -1)[1]
+		# per detection statistics, vectorized through cumulative sums along the grid
+		snr = spec/self.floor
+		c_pow = np.pad(np.cumsum(spec, axis=1), ((0, 0), (1, 0)))
+		c_log = np.pad(np.cumsum(np.log(spec+1e-30), axis=1), ((0, 0), (1, 0)))
+		width = g1-g0
+		mean_pow = (c_pow[s_row, g1]-c_pow[s_row, g0])/width
+		flat = np.exp((c_log[s_row, g1]-c_log[s_row, g0])/width)/mean_pow
+		# peak of every detection in one pass: reduce over [start, end) pairs of the flattened
+		# spectrum (with a sentinel so the last end is a valid index) and keep the even ones
+		bounds = np.column_stack((s_row*self.num_grid+g0, s_row*self.num_grid+g1)).ravel()
+		peak = np.maximum.reduceat(np.append(snr.ravel(), -np.inf), bounds)[::2] if len(s_row) else np.zeros(0)
+		narrow = np.bincount(s_row[width*self.df < 3e6], minlength=len(frames))
+		nearby = np.log2(1+np.convolve(narrow, np.ones(3), mode='same'))
+
+		done = []
+		row_start = np.searchsorted(s_row, np.arange(len(frames)+1))
+		for r in range(len(frames)):
+			dets = range(row_start[r], row_start[r+1])
+			still = []
+			claimed = set()
+			for burst in self.active:
+				hit = [d for d in dets if d not in claimed and g0[d] <= burst['g1'] and g1[d] >= burst['g0']]
+				if not hit:
+					done.append(burst)
+					continue
+				claimed.update(hit)
+				for d in hit:
+					burst['g0'] = min(burst['g0'], g0[d])
+					burst['g1'] = max(burst['g1'], g1[d])
+				burst['last'] = self.sweep+r
+				burst['n'] = burst['n']+len(hit)
+				burst['width'] = burst['width']+sum(width[d] for d in hit)
+				burst['flat'] = burst['flat']+sum(flat[d] for d in hit)
+				burst['near'] = burst['near']+nearby[r]
+				burst['peak'] = max(burst['peak'], max(peak[d] for d in hit))
+				still.append(burst)
+			for d in dets:
+				if d not in claimed:
+					still.append({'first': self.sweep+r, 'last': self.sweep+r, 'g0': g0[d], 'g1': g1[d], 'n': 1,
+						'width': width[d], 'flat': flat[d], 'near': nearby[r], 'peak': peak[d]})
+			self.active = still
+		self.sweep = self.sweep+len(frames)
+		return self._classify(done)
+
+	def flush(self):
+		"""Classifies the bursts still open, at the end of a capture."""
+		done = self.active
+		self.active = []
+		return self._classify(done)
+
+	def _classify(self, bursts):
+		n = np.array([b['n'] for b in bursts], dtype=np.float64)
+		first = np.array([b['first'] for b in bursts], dtype=np.float64)
+		last = np.array([b['last'] for b in bursts], dtype=np.float64)
+		bandwidth = np.array([b['width'] for b in bursts], dtype=np.float64)/np.maximum(n, 1)*self.df
+		duration = (last-first+1)*self.period
+		features = np.column_stack((np.log10(bandwidth/1e6+1e-9), np.log10(duration*1e3+1e-9),
+			np.array([b['flat'] for b in bursts])/np.maximum(n, 1), np.array([b['near'] for b in bursts], dtype=np.float64)/(last-first+1),
+			10*np.log10(np.array([b['peak'] for b in bursts], dtype=np.float64)+1e-30)/10)) if bursts else np.zeros((0, len(BURST_FEATURES)))
+		z = ((features-self.model['mean'])/self.model['std']).dot(np.asarray(self.model['W']).T)+self.model['b']
+		p = np.exp(z-z.max(axis=1, keepdims=True)) if len(z) else z
+		p = p/p.sum(axis=1, keepdims=True) if len(z) else p
+		center = self.f_min+(np.array([b['g0']+b['g1'] for b in bursts], dtype=np.float64)/2-0.5)*self.df
+		return {'start': first*self.period, 'end': (last+1)*self.period, 'center': center,
+			'bandwidth': bandwidth, 'features': features, 'label': np.argmax(p, axis=1) if len(p) else np.zeros(0, dtype=np.int64),
+			'confidence': np.max(p, axis=1) if len(p) else np.zeros(0)}
+
+def _write_bursts(handle, events, time_ref):
+	for k in range(len(events['start'])):
+		handle.write("%.6f,%.6f,%.0f,%.0f,%s,%.3f\n" % (time_ref+events['start'][k], time_ref+events['end'][k],
+			events['center'][k], events['bandwidth'][k], BURST_CLASSES[events['label'][k]], events['confidence'][k]))
+	handle.flush()
+
+def _burst_setup(options):
+	table = load_vco_table(options.vco_table, options)
+	return burst_classifier(options, table, _cal_tone_list(options))
+
+class burst_classifier_sink(gr.sync_block):
+	"""Runs a burst_classifier on the live stream and appends labeled events to options.burst_log.
+
+	Event times are host time, anchored at the first sample (or at rx_time tags from the USRP).
+	"""
+
+	def __init__(self,options):
+		gr.sync_block.__init__(self, name="burst_classifier_sink", in_sig=[np.complex64], out_sig=None)
+		self.classifier = _burst_setup(options)
+		self.frame_len = self.classifier.frame_len
+		self.buffer = np.zeros(getattr(options, 'burst_batch', 16)*self.frame_len, dtype=np.complex64)
+		self.fill = 0
+		self.samp = float(options.samp)
+		self.stride = getattr(options, 'inN', 1)
+		self.time_ref = None
+		self.handle = open(options.burst_log, 'w')
+		self.handle.write("start,end,center_hz,bandwidth_hz,label,confidence\n")
+
+	def work(self, input_items, output_items):
+		x = input_items[0]
+		# only one sweep in every inN reaches this block, so kept samples are scaled by inN
+		if self.time_ref is None:
+			self.time_ref = time.time()-self.nitems_read(0)*self.stride/self.samp
+		for tag in self.get_tags_in_window(0, 0, len(x), pmt.intern("rx_time")):
+			secs = pmt.to_uint64(pmt.tuple_ref(tag.value, 0))+pmt.to_double(pmt.tuple_ref(tag.value, 1))
+			self.time_ref = secs-tag.offset*self.stride/self.samp
+		used = 0
+		while used < len(x):
+			n = min(len(x)-used, len(self.buffer)-self.fill)
+			self.buffer[self.fill:self.fill+n] = x[used:used+n]
+			self.fill = self.fill+n
+			used = used+n
+			if self.fill == len(self.buffer):
+				_write_bursts(self.handle, self.classifier.process(self.buffer.reshape(-1, self.frame_len)), self.time_ref)
+				self.fill = 0
+		return len(x)
+
+	def stop(self):
+		# classify the whole sweeps of a partial batch before closing the open bursts
+		sweeps = self.fill//self.frame_len
+		if sweeps > 0:
+			_write_bursts(self.handle, self.classifier.process(self.buffer[:sweeps*self.frame_len].reshape(sweeps, self.frame_len)), self.time_ref)
+		self.fill = 0
+		_write_bursts(self.handle, self.classifier.flush(), self.time_ref or 0.0)
+		self.handle.close()
+		return True
+
+def classify_bursts(options):
+	"""Labels the bursts in a saved capture as WiFi, Bluetooth or other.
+
+	Inputs:
+		1. options (object)
+	Outputs:
+		Dictionary of arrays, one entry per burst: start and end (s from the start of the capture),
+		center and bandwidth (Hz), features (see BURST_FEATURES), label (index into
+		BURST_CLASSES) and confidence.
+
+	The events are also written to options.burst_log as CSV, if it is set. The features can be
+	labeled by hand and passed to train_burst_model() to replace the default model.
+
+	Attributes of options:
+		1. filename: [<path_to_capture>] (list)
+
+		2. vco_table, cal_tones: As for channelize(). cal_tones is left unset for mode 30 captures.
+
+		3. burst_nfft: FFT size; the RF grid resolution is samp/burst_nfft. (int, default 256)
+
+		4. burst_threshold: Detection threshold in dB above the noise floor. (float, default 10)
+
+		5. burst_usable: Fraction of the baseband used for the RF grid. (float, default 0.8)
+
+		6. burst_gap: Gaps up to this width (Hz) inside a burst are closed. (float, default 0.5e6)
+
+		7. burst_batch: Sweeps classified at a time. (int, default 16)
+
+		8. burst_model: Model saved by train_burst_model(). (str, default is the built-in model)
+
+		9. burst_log: CSV file for the events. (str, optional)
+
+		10. band1, band2, step, rf_div, samp, sweep_time, num_bands, inN: Capture settings.
+	"""
+	classifier = _burst_setup(options)
+	frames = _capture_frames(options.filename[0], classifier.frame_len)
+	batch = getattr(options, 'burst_batch', 16)
+	handle = None
+	if getattr(options, 'burst_log', None):
+		handle = open(options.burst_log, 'w')
+		handle.write("start,end,center_hz,bandwidth_hz,label,confidence\n")
+	start_time = time.time()
+	results = []
+	for first in range(0, len(frames), batch):
+		results.append(classifier.process(frames[first:first+batch]))
+	_close_frames(frames)
+	results.append(classifier.flush())
+	events = dict((k, np.concatenate([r[k] for r in results])) for k in results[-1])
+	if handle is not None:
+		_write_bursts(handle, events, 0.0)
+		handle.close()
+	print("Classified "+str(len(events['start']))+" bursts in "+str(len(frames))+" sweeps in "+str(time.time()-start_time)+" seconds")
+	for (k, name) in enumerate(BURST_CLASSES):
+		print("  "+name+": "+str(np.count_nonzero(events['label'] == k)))
+	return events